@@ -0,0 +1,84 @@
+import base64
+import os
+import threading
+from typing import Dict, Tuple
+
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
+
+# ---------------------------------------------------------------------------
+#   Stable Diffusion (A1111) HTTP client
+# ---------------------------------------------------------------------------
+# One client per server URL, each with a persistent requests.Session: the
+# TCP connection stays open between renders, connection failures and
+# 502/503/504 answers are retried with exponential backoff, and every call
+# has a timeout. The image comes back as base64 PNG; it is decoded and
+# written as-is (no PIL decode / re-encode).
+#   SD_CONNECT_TIMEOUT   seconds to connect        (default 5)
+#   SD_READ_TIMEOUT      seconds to wait for image (default 300, hires.fix is slow)
+#   SD_RETRIES           retries per request       (default 3)
+# ---------------------------------------------------------------------------
+
+CONNECT_TIMEOUT = float(os.getenv("SD_CONNECT_TIMEOUT", "5"))
+READ_TIMEOUT = float(os.getenv("SD_READ_TIMEOUT", "300"))
+RETRIES = int(os.getenv("SD_RETRIES", "3"))
+
+
+class SDClient:
+    def __init__(
+        self,
+        base_url: str,
+        timeout: Tuple[float, float] = (CONNECT_TIMEOUT, READ_TIMEOUT),
+        retries: int = RETRIES,
+        backoff: float = 0.5
+    ):
+        self.base_url = base_url.rstrip("/")
+        self.timeout = timeout
+        retry = Retry(
+            total=retries,
+            connect=retries,
+            read=0,                       # a read timeout means the render is running – don't resend it
+            status=retries,
+            backoff_factor=backoff,
+            status_forcelist=(502, 503, 504),
+            allowed_methods=frozenset({"GET", "POST"}),
+            raise_on_status=False,
+        )
+        self.session = requests.Session()
+        adapter = HTTPAdapter(max_retries=retry, pool_connections=1, pool_maxsize=2)
+        self.session.mount("http://", adapter)
+        self.session.mount("https://", adapter)
+
+    def txt2img(self, payload: dict) -> bytes:
+        """Render `payload` and return the first image as PNG bytes."""
+        resp = self.session.post(f"{self.base_url}/sdapi/v1/txt2img", json=payload, timeout=self.timeout)
+        resp.raise_for_status()
+        return base64.b64decode(resp.json()["images"][0])
+
+    def render(self, payload: dict, output: str) -> str:
+        """txt2img straight to `output` (written via a temp file + rename)."""
+        data = self.txt2img(payload)
+        tmp = f"{output}.part"
+        with open(tmp, "wb") as f:
+            f.write(data)
+        os.replace(tmp, output)
+        return output
+
+    def interrupt(self, timeout: float = 2.0):
+        """Stop whatever this server is rendering right now."""
+        self.session.post(f"{self.base_url}/sdapi/v1/interrupt", timeout=timeout)
+
+
+_lock = threading.Lock()
+_clients: Dict[str, SDClient] = {}
+
+
+def get_client(base_url: str) -> SDClient:
+    """Shared client (and connection) per server URL."""
+    base_url = base_url.rstrip("/")
+    with _lock:
+        client = _clients.get(base_url)
+        if client is None:
+            client = _clients[base_url] = SDClient(base_url)
+        return client
@@ -0,0 +1,97 @@
+import argparse
+import base64
+import hashlib
+import json
+import threading
+import time
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from io import BytesIO
+
+from PIL import Image
+
+# ---------------------------------------------------------------------------
+#   Stand-in for the A1111 API, for testing the SD job queue offline
+# ---------------------------------------------------------------------------
+#   python -m sd.fake_server --port 7860 --delay 4
+# Implements just what we call:
+#   POST /sdapi/v1/txt2img    "renders" for --delay seconds, then returns a
+#                             flat PNG whose colour is derived from the prompt
+#   POST /sdapi/v1/interrupt  ends the running render early (like A1111, the
+#                             interrupted request still answers with an image)
+# ---------------------------------------------------------------------------
+
+
+class FakeSD:
+    def __init__(self, delay: float = 3.0):
+        self.delay = delay
+        self.interrupted = threading.Event()
+        self.lock = threading.Lock()        # one render at a time, like A1111
+        self.stats = {"renders": 0, "interrupts": 0}
+
+    def txt2img(self, payload: dict) -> dict:
+        with self.lock:
+            self.interrupted.clear()
+            self.interrupted.wait(self.delay)
+            self.stats["renders"] += 1
+            prompt = payload.get("prompt", "")
+            colour = hashlib.blake2b(prompt.encode("utf-8"), digest_size=3).digest()
+            size = (int(payload.get("width", 768)), int(payload.get("height", 512)))
+            buf = BytesIO()
+            Image.new("RGB", size, tuple(colour)).save(buf, format="PNG")
+            return {"images": [base64.b64encode(buf.getvalue()).decode("ascii")],
+                    "parameters": payload,
+                    "info": json.dumps({"prompt": prompt, "interrupted": self.interrupted.is_set()})}
+
+    def interrupt(self) -> dict:
+        self.stats["interrupts"] += 1
+        self.interrupted.set()
+        return {}
+
+
+def make_handler(sd: FakeSD):
+    class Handler(BaseHTTPRequestHandler):
+        def _reply(self, code: int, body: dict):
+            data = json.dumps(body).encode("utf-8")
+            self.send_response(code)
+            self.send_header("Content-Type", "application/json")
+            self.send_header("Content-Length", str(len(data)))
+            self.end_headers()
+            self.wfile.write(data)
+
+        def do_POST(self):
+            length = int(self.headers.get("Content-Length") or 0)
+            raw = self.rfile.read(length) if length else b""
+            if self.path == "/sdapi/v1/txt2img":
+                self._reply(200, sd.txt2img(json.loads(raw or b"{}")))
+            elif self.path == "/sdapi/v1/interrupt":
+                self._reply(200, sd.interrupt())
+            else:
+                self._reply(404, {"detail": "Not Found"})
+
+        def do_GET(self):
+            if self.path == "/stats":
+                self._reply(200, sd.stats)
+            else:
+                self._reply(404, {"detail": "Not Found"})
+
+        def log_message(self, fmt, *args):
+            print(f"[fake-sd {time.strftime('%H:%M:%S')}] {fmt % args}")
+
+    return Handler
+
+
+def serve(host: str = "127.0.0.1", port: int = 7860, delay: float = 3.0) -> ThreadingHTTPServer:
+    """Start the server on a daemon thread and return it (call .shutdown() to stop)."""
+    server = ThreadingHTTPServer((host, port), make_handler(FakeSD(delay)))
+    threading.Thread(target=server.serve_forever, daemon=True, name="fake-sd").start()
+    return server
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Fake Stable Diffusion (A1111) API server")
+    parser.add_argument("--host", default="127.0.0.1")
+    parser.add_argument("--port", type=int, default=7860)
+    parser.add_argument("--delay", type=float, default=3.0, help="seconds per render")
+    args = parser.parse_args()
+    print(f"Fake SD listening on http://{args.host}:{args.port} ({args.delay}s per image)")
+    ThreadingHTTPServer((args.host, args.port), make_handler(FakeSD(args.delay))).serve_forever()
@@ -0,0 +1,125 @@
+import hashlib
+import json
+import os
+import threading
+import time
+from collections import OrderedDict
+from typing import Dict, Optional
+
+# ---------------------------------------------------------------------------
+#   Content-addressed cache of rendered scenes
+# ---------------------------------------------------------------------------
+# Images are stored as <root>/<key[:2]>/<key>.png, where key hashes every
+# txt2img setting that changes the picture (prompt, negative prompt, seed,
+# sampler, checkpoint, size, …). A hit skips Stable Diffusion entirely, and
+# since every image has its own file, older reply versions keep theirs.
+# `index.json` maps key → {size, used}; it is loaded once, looked up in O(1)
+# and kept in LRU order, evicting the least recently used images once the
+# cache grows past `max_bytes`.
+#   SD_CACHE_DIR   cache folder (default sd/cache)
+#   SD_CACHE_MB    size cap in MiB (default 512)
+# ---------------------------------------------------------------------------
+
+DEFAULT_CACHE_DIR = os.path.join(os.path.dirname(__file__), "cache")
+INDEX_FILE = "index.json"
+
+
+def cache_key(payload: dict) -> str:
+    """Stable hash of a txt2img payload (key order does not matter)."""
+    blob = json.dumps(payload, sort_keys=True, ensure_ascii=False, separators=(",", ":"))
+    return hashlib.sha256(blob.encode("utf-8")).hexdigest()
+
+
+class ImageCache:
+    """Size-capped LRU of PNG files, keyed by `cache_key(payload)`. Thread-safe."""
+
+    def __init__(self, root: Optional[str] = None, max_bytes: Optional[int] = None):
+        self.root = root or os.environ.get("SD_CACHE_DIR", DEFAULT_CACHE_DIR)
+        if max_bytes is None:
+            max_bytes = int(float(os.environ.get("SD_CACHE_MB", "512")) * 1024 * 1024)
+        self.max_bytes = max_bytes
+        self._lock = threading.Lock()
+        self._index: "OrderedDict[str, Dict]" = OrderedDict()   # oldest use first
+        self._bytes = 0
+        self._loaded = False
+        self.stats = {"hits": 0, "misses": 0, "stored": 0, "evicted": 0}
+
+    # ── index file ─────────────────────────────────────────────────────────
+    def _load(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        os.makedirs(self.root, exist_ok=True)
+        try:
+            with open(os.path.join(self.root, INDEX_FILE), "r", encoding="utf-8") as f:
+                entries = json.load(f)
+        except (OSError, ValueError):
+            return
+        for key, meta in sorted(entries.items(), key=lambda kv: kv[1].get("used", 0)):
+            self._index[key] = meta
+            self._bytes += meta.get("size", 0)
+
+    def _save(self):
+        path = os.path.join(self.root, INDEX_FILE)
+        tmp = path + ".tmp"
+        with open(tmp, "w", encoding="utf-8") as f:
+            json.dump(self._index, f)
+        os.replace(tmp, path)
+
+    # ── API ────────────────────────────────────────────────────────────────
+    def path_for(self, key: str) -> str:
+        """Where the image for `key` lives (the directory is created)."""
+        folder = os.path.join(self.root, key[:2])
+        os.makedirs(folder, exist_ok=True)
+        return os.path.join(folder, f"{key}.png")
+
+    def get(self, key: str) -> Optional[str]:
+        """Path of the cached image, or None. A hit becomes most recently used."""
+        with self._lock:
+            self._load()
+            meta = self._index.get(key)
+            path = os.path.join(self.root, key[:2], f"{key}.png")
+            if meta is None or not os.path.exists(path):
+                if meta is not None:           # file removed behind our back
+                    self._bytes -= self._index.pop(key).get("size", 0)
+                self.stats["misses"] += 1
+                return None
+            meta["used"] = time.time()
+            self._index.move_to_end(key)
+            self.stats["hits"] += 1
+            return path
+
+    def add(self, key: str):
+        """Record the image just written to `path_for(key)`, then evict if over the cap."""
+        with self._lock:
+            self._load()
+            try:
+                size = os.path.getsize(os.path.join(self.root, key[:2], f"{key}.png"))
+            except OSError:
+                return
+            old = self._index.pop(key, None)
+            if old is not None:
+                self._bytes -= old.get("size", 0)
+            self._index[key] = {"size": size, "used": time.time()}
+            self._bytes += size
+            self.stats["stored"] += 1
+            self._evict()
+            self._save()
+
+    def _evict(self):
+        while self._bytes > self.max_bytes and len(self._index) > 1:
+            key, meta = self._index.popitem(last=False)
+            self._bytes -= meta.get("size", 0)
+            self.stats["evicted"] += 1
+            try:
+                os.remove(os.path.join(self.root, key[:2], f"{key}.png"))
+            except OSError:
+                pass
+
+    def cache_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, images=len(self._index), bytes=self._bytes)
+
+
+# shared by every chat in this process
+image_cache = ImageCache()
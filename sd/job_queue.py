@@ -0,0 +1,196 @@
+import os
+import threading
+from collections import OrderedDict
+from typing import Callable, Dict, List, Optional
+
+import requests
+
+from sd.client import get_client
+from sd.sd_test import SD_URL, render
+
+# ---------------------------------------------------------------------------
+#   Asynchronous txt2img job queue
+# ---------------------------------------------------------------------------
+# The chat never waits for Stable Diffusion: a turn submits a job and moves
+# on, and `on_done(path)` fires from a dispatcher thread once the image is on
+# disk. At most one job per session is ever waiting; a newer job replaces it,
+# and a job already rendering for that session is interrupted on its worker
+# (A1111 /sdapi/v1/interrupt) and its result dropped. Jobs render to a
+# private temp file that only reaches `output` if the job was not cancelled,
+# so superseded renders never leave stray files behind. One dispatcher thread
+# per worker URL, so several SD servers render in parallel:
+#   SD_WORKERS="http://127.0.0.1:7860,http://127.0.0.1:7861"
+# For offline testing run `python -m sd.fake_server`.
+# ---------------------------------------------------------------------------
+
+INTERRUPT_TIMEOUT = 2.0
+
+
+def _worker_urls() -> List[str]:
+    urls = os.environ.get("SD_WORKERS", SD_URL)
+    return [u.strip().rstrip("/") for u in urls.split(",") if u.strip()]
+
+
+class SDJob:
+    __slots__ = ("session", "payload", "output", "on_done", "worker", "cancelled")
+
+    def __init__(self, session: str, payload: dict, output: str,
+                 on_done: Optional[Callable[[str], None]]):
+        self.session = session
+        self.payload = payload
+        self.output = output
+        self.on_done = on_done
+        self.worker: Optional[str] = None   # URL while rendering
+        self.cancelled = False
+
+
+class SDJobQueue:
+    """
+    Per-session, supersede-on-submit job queue over one or more SD servers.
+    `render(payload, output, base_url)` does the actual request (sd_test.render).
+    """
+
+    def __init__(self, workers: Optional[List[str]] = None,
+                 render: Callable[[dict, str, str], str] = render):
+        self.workers = workers or _worker_urls()
+        self._render = render
+        self._cond = threading.Condition()
+        self._pending: "OrderedDict[str, SDJob]" = OrderedDict()   # session → job, FIFO
+        self._running: Dict[str, SDJob] = {}
+        self._finishing = 0                                          # on_done callbacks running
+        # held while an interrupt is in flight to a worker, and by that
+        # worker's dispatcher while it retires a job, so /interrupt can only
+        # ever hit the job it was meant for
+        self._worker_locks = {url: threading.Lock() for url in self.workers}
+        self._threads: List[threading.Thread] = []
+        self.stats = {"submitted": 0, "superseded": 0, "interrupted": 0,
+                      "completed": 0, "failed": 0}
+
+    def _start(self):
+        if self._threads:
+            return
+        for url in self.workers:
+            t = threading.Thread(target=self._dispatch, args=(url,), daemon=True,
+                                 name=f"sd-worker {url}")
+            t.start()
+            self._threads.append(t)
+
+    # ── API ────────────────────────────────────────────────────────────────
+    def submit(self, session: str, payload: dict, output: str,
+               on_done: Optional[Callable[[str], None]] = None) -> SDJob:
+        """Queue a render for `session`, superseding its waiting/running job."""
+        job = SDJob(session, payload, output, on_done)
+        with self._cond:
+            self._start()
+            self.stats["submitted"] += 1
+            if session in self._pending:       # replace in place, keep its turn
+                self._pending[session].cancelled = True
+                self.stats["superseded"] += 1
+            self._pending[session] = job
+            running = self._running.get(session)
+            self._cond.notify()
+        if running is not None:
+            self._interrupt(running)
+        return job
+
+    def cancel(self, session: str):
+        """Drop the session's waiting job and interrupt the one rendering."""
+        with self._cond:
+            job = self._pending.pop(session, None)
+            if job is not None:
+                job.cancelled = True
+                self.stats["superseded"] += 1
+            running = self._running.get(session)
+        if running is not None:
+            self._interrupt(running)
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until nothing is waiting or rendering and every `on_done` has
+        returned. Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._running and not self._finishing, timeout)
+
+    def queue_stats(self) -> Dict[str, int]:
+        with self._cond:
+            return dict(self.stats, pending=len(self._pending),
+                        running=len(self._running), workers=len(self.workers))
+
+    # ── internals ──────────────────────────────────────────────────────────
+    def _interrupt(self, job: SDJob):
+        with self._cond:
+            if job.cancelled:
+                return
+            job.cancelled = True
+            url = job.worker
+            self.stats["interrupted"] += 1
+        if url is None:
+            return
+        with self._worker_locks[url]:
+            with self._cond:
+                if self._running.get(job.session) is not job:   # finished meanwhile
+                    return
+            try:
+                get_client(url).interrupt(timeout=INTERRUPT_TIMEOUT)
+            except requests.RequestException as exc:
+                print(f"⚠️ SD interrupt failed on {url}: {exc}")
+
+    def _dispatch(self, url: str):
+        while True:
+            with self._cond:
+                # a session renders on one worker at a time
+                self._cond.wait_for(
+                    lambda: any(s not in self._running for s in self._pending))
+                session = next(s for s in self._pending if s not in self._running)
+                job = self._pending.pop(session)
+                job.worker = url
+                self._running[session] = job
+            path = None
+            tmp = f"{job.output}.{threading.get_ident()}.job"
+            try:
+                path = self._render(job.payload, tmp, url)
+            except Exception as exc:  # one bad job must not kill the worker
+                if not job.cancelled:
+                    print(f"⚠️ SD job for {session} failed on {url}: {exc}")
+            finally:
+                with self._worker_locks[url], self._cond:
+                    path = self._publish(job, path)
+                    del self._running[session]
+                    if not job.cancelled:
+                        self.stats["completed" if path is not None else "failed"] += 1
+                    notify = path is not None and not job.cancelled and job.on_done is not None
+                    if notify:
+                        self._finishing += 1
+                    self._cond.notify_all()
+            if not notify:
+                continue
+            try:
+                job.on_done(path)
+            except Exception as exc:
+                print(f"⚠️ SD on_done for {session} failed: {exc}")
+            finally:
+                with self._cond:
+                    self._finishing -= 1
+                    self._cond.notify_all()
+
+
+    @staticmethod
+    def _publish(job: SDJob, rendered: Optional[str]) -> Optional[str]:
+        """Move a finished render into place, or drop it if the job was cancelled. Caller holds the lock."""
+        if rendered is None:
+            return None
+        try:
+            if job.cancelled:
+                os.remove(rendered)
+                return None
+            os.replace(rendered, job.output)
+            return job.output
+        except OSError as exc:
+            print(f"⚠️ SD output {job.output} could not be written: {exc}")
+            return None
+
+
+# the one queue shared by every chat in this process
+sd_queue = SDJobQueue()
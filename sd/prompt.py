@@ -6,7 +6,7 @@ from pathlib import Path
 from typing import Optional
 from utils.memory import MemoryManager
 from langchain_core.prompts import ChatPromptTemplate
-from langchain_ollama import OllamaLLM
+from utils.llm_registry import get_llm
 
 
 def generate_sd_prompt(
@@ -14,13 +14,17 @@ def generate_sd_prompt(
     ch: dict,
     model_name: str = "llama3",
     output_dir: Optional[Path | str] = None,
-    filename: str = "prompt.json"
+    filename: str = "prompt.json",
+    save: bool = True,
+    llm_options: Optional[dict] = None
 ) -> dict:
     """
     根據 MemoryManager 中的 summary 與 fact_memory
     使用 LLaMA3 產生一份適用於 Stable Diffusion 的 prompt JSON，
     並將結果儲存到磁碟上。路徑可由 `output_dir` 參數或環境變數 SD_PROMPT_DIR
     控制，否則預設寫入 <project_root>/sd/prompt.json。
+    save=False 時只回傳結果、不寫檔（聊天流程直接把 prompt 交給 SD client）。
+    llm_options 原樣傳給 get_llm；與聊天鏈相同的選項才能共用已載入的模型。
     """
 
     # ── 1) 抓記憶 ────────────────────────────────────────────────────────
@@ -46,7 +50,7 @@ Extracted facts and inspiration:
 """)
 
     # ── 3) 呼叫 LLaMA3 模型 ───────────────────────────────────────────────
-    chain = prompt_template | OllamaLLM(model=model_name)
+    chain = prompt_template | get_llm(model_name, **(llm_options or {}))
     response = chain.invoke({
         # these keys won’t matter since we inlined summary & fact_str via f-string,
         # but kept here if you switch back to dynamic placeholders:
@@ -64,6 +68,8 @@ Extracted facts and inspiration:
         raw_prompt = result.get("prompt", "").strip()
         new_prompt = ", ".join(filter(None, [ch_marker, lora_tag, raw_prompt]))
         result["prompt"] = new_prompt
+        if not save:
+            return result
 
         # ── 5) 決定輸出路徑 ───────────────────────────────────────────────
         #  a) caller override
@@ -0,0 +1,147 @@
+import re
+from typing import Dict, FrozenSet, Iterable, Optional, Tuple
+
+# ---------------------------------------------------------------------------
+#   Scene-change gate for Stable Diffusion
+# ---------------------------------------------------------------------------
+# Most turns are dialogue inside one scene, where a new prompt + txt2img would
+# just repaint the same picture. The tracker keeps the visual state of the
+# image on screen –
+#     location · outfit · emotion · characters present
+# – reads what each turn says about those slots (user input, narration and
+# reply – the text the memory delta is extracted from) and only asks for a
+# render when one of them gained a new value. Slots a turn does not mention
+# keep their value, so "nothing visual was said" == no render, and repeating
+# part of the current state ("she smiles" while already happy) is no change.
+# ---------------------------------------------------------------------------
+
+SCENE_SLOTS = ("location", "outfit", "emotion", "characters")
+
+# canonical value → words that mean it (English + common CJK)
+_LEXICON: Dict[str, Dict[str, Tuple[str, ...]]] = {
+    "location": {
+        "bedroom":   ("bedroom", "bed room", "臥室", "房間"),
+        "kitchen":   ("kitchen", "廚房"),
+        "bathroom":  ("bathroom", "bath", "shower", "浴室"),
+        "classroom": ("classroom", "class room", "教室"),
+        "school":    ("school", "campus", "hallway", "學校"),
+        "rooftop":   ("rooftop", "roof", "屋頂"),
+        "office":    ("office", "辦公室"),
+        "cafe":      ("cafe", "café", "coffee shop", "restaurant", "咖啡廳", "餐廳"),
+        "street":    ("street", "city", "town", "alley", "街"),
+        "park":      ("park", "garden", "公園"),
+        "beach":     ("beach", "sea", "ocean", "shore", "海邊", "沙灘"),
+        "forest":    ("forest", "woods", "森林"),
+        "train":     ("train", "station", "subway", "車站", "電車"),
+        "car":       ("car", "車上"),
+        "cockpit":   ("cockpit", "entry plug", "駕駛艙"),
+        "base":      ("base", "hangar", "lab", "laboratory", "headquarters", "基地"),
+        "shop":      ("shop", "store", "mall", "商店"),
+        "home":      ("living room", "apartment", "home", "house", "客廳", "家"),
+        "outdoors":  ("outside", "outdoors", "field", "mountain", "戶外"),
+    },
+    "outfit": {
+        "school uniform": ("school uniform", "uniform", "制服"),
+        "plugsuit":       ("plugsuit", "plug suit", "戰鬥服"),
+        "swimsuit":       ("swimsuit", "bikini", "泳裝"),
+        "pajamas":        ("pajamas", "pyjamas", "nightgown", "睡衣"),
+        "dress":          ("dress", "gown", "洋裝"),
+        "kimono":         ("kimono", "yukata", "和服", "浴衣"),
+        "casual":         ("casual clothes", "t-shirt", "jeans", "hoodie", "便服"),
+        "coat":           ("coat", "jacket", "外套"),
+        "towel":          ("towel", "毛巾"),
+        "armor":          ("armor", "armour", "盔甲"),
+    },
+    "emotion": {
+        "happy":       ("happy", "smile", "smiles", "smiled", "smiling", "grin", "grins", "laugh", "laughs", "laughing", "笑"),
+        "sad":         ("sad", "cry", "cries", "crying", "tears", "sob", "sobs", "哭", "難過"),
+        "angry":       ("angry", "furious", "glare", "glares", "glaring", "scowl", "scowls", "yell", "yells", "生氣"),
+        "embarrassed": ("blush", "blushes", "blushed", "blushing", "embarrassed", "flustered", "臉紅", "害羞"),
+        "surprised":   ("surprised", "shocked", "gasp", "gasps", "驚訝"),
+        "scared":      ("scared", "afraid", "trembling", "frightened", "害怕"),
+        "calm":        ("calm", "relaxed", "peaceful", "平靜"),
+    },
+}
+
+
+def _compile(words: Iterable[str]) -> re.Pattern:
+    # ASCII words need word boundaries ("bath" ≠ "bathe"); CJK has no spaces
+    parts = sorted(words, key=len, reverse=True)
+    alts = [rf"\b{re.escape(w)}\b" if w.isascii() else re.escape(w) for w in parts]
+    return re.compile("|".join(alts), re.IGNORECASE)
+
+
+_MATCHERS = {
+    slot: [(value, _compile(words)) for value, words in values.items()]
+    for slot, values in _LEXICON.items()
+}
+
+
+def _name_aliases(names: Iterable[str]) -> Dict[str, str]:
+    """"Soryu Asuka Langley" → {"soryu", "asuka", "langley"} → full name."""
+    aliases: Dict[str, str] = {}
+    for name in names:
+        for part in re.split(r"[\s/_\-]+", name):
+            if len(part) >= 3:
+                aliases[part.lower()] = name
+    return aliases
+
+
+def extract_scene(text: str, aliases: Optional[Dict[str, str]] = None) -> Dict[str, FrozenSet[str]]:
+    """Visual slots mentioned in `text` (a slot is left out when not mentioned)."""
+    found: Dict[str, FrozenSet[str]] = {}
+    for slot, matchers in _MATCHERS.items():
+        hits = frozenset(value for value, rx in matchers if rx.search(text))
+        if hits:
+            found[slot] = hits
+    if aliases:
+        words = set(re.findall(r"\w+", text.lower()))
+        present = frozenset(aliases[w] for w in words if w in aliases)
+        if present:
+            found["characters"] = present
+    return found
+
+
+class SceneTracker:
+    """
+    Visual state of one chat's current image.
+
+    `observe(text)` folds a turn into the pending state; `changed()` tells
+    whether it differs from what was last rendered; `commit()` is called once
+    the image for the pending state is on disk (so a failed render retries).
+    """
+
+    def __init__(self, names: Iterable[str] = ()):
+        self._aliases = _name_aliases(names)
+        self.rendered: Dict[str, FrozenSet[str]] = {}
+        self.pending: Dict[str, FrozenSet[str]] = {}
+        self.image: Optional[str] = None      # file showing `rendered`
+        self.stats = {"turns": 0, "renders": 0, "skipped": 0}
+
+    def observe(self, text: str) -> Dict[str, FrozenSet[str]]:
+        self.stats["turns"] += 1
+        seen = extract_scene(text, self._aliases)
+        self.pending.update(seen)
+        return seen
+
+    def changes(self) -> Dict[str, Tuple[FrozenSet[str], FrozenSet[str]]]:
+        """slot → (rendered value, pending value) for every slot with a new value."""
+        out = {}
+        for slot in SCENE_SLOTS:
+            old = self.rendered.get(slot, frozenset())
+            new = self.pending.get(slot, frozenset())
+            if new - old:
+                out[slot] = (old, new)
+        return out
+
+    def changed(self) -> bool:
+        """True on the first turn (nothing rendered yet) or after a visual change."""
+        return not self.stats["renders"] or bool(self.changes())
+
+    def commit(self, image: Optional[str] = None):
+        self.rendered = dict(self.pending)
+        self.image = image
+        self.stats["renders"] += 1
+
+    def skip(self):
+        self.stats["skipped"] += 1
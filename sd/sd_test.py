@@ -1,17 +1,13 @@
-import os, json, base64
-from PIL import Image
-from io import BytesIO
-import requests
+import os, json
 
-def generate_image_from_json(json_path: str = "prompt.json", output_name="output.png"):
-    # loading prompt.json
-    json_path = os.path.join(os.path.dirname(__file__), "prompt.json")
-    with open(json_path, "r", encoding="utf-8") as f:
-        data = json.load(f)
+from sd.client import get_client
 
-    # api server(local)
-    url = "http://127.0.0.1:7860/sdapi/v1/txt2img"
-    prompt = data.get("prompt", "")
+# api server(local); the job queue may spread work over several of these
+SD_URL = "http://127.0.0.1:7860"
+
+
+def build_payload(prompt: str) -> dict:
+    """txt2img request body for `prompt` with our fixed model / hires.fix settings."""
     negative_prompt = "(worst quality, low quality, normal quality), (zombie, interlocked fingers, extra limbs, mutated hands, missing arms, blurry face, deformed eyes, bad anatomy)"
 
     # parameter
@@ -44,14 +40,19 @@ def generate_image_from_json(json_path: str = "prompt.json", output_name="output
         "hr_second_pass_steps": 10,
         "denoising_strength": 0.5,
     }
+    return payload
 
-    # http POST
-    response = requests.post(url, json=payload)
-
-    # get image(base64)
-    result = response.json()
-    image_data = result['images'][0]
 
-    image = Image.open(BytesIO(base64.b64decode(image_data)))
-    image.save(output_name)
+def render(payload: dict, output_name: str = "output.png", base_url: str = SD_URL) -> str:
+    """POST one txt2img job to `base_url` and save the PNG; returns output_name."""
+    get_client(base_url).render(payload, output_name)
     print(f"✅ SD image saved to {output_name}")
+    return output_name
+
+
+def generate_image_from_json(json_path: str = "prompt.json", output_name="output.png"):
+    # loading prompt.json (relative paths are inside sd/)
+    json_path = os.path.join(os.path.dirname(__file__), json_path)
+    with open(json_path, "r", encoding="utf-8") as f:
+        data = json.load(f)
+    return render(build_payload(data.get("prompt", "")), output_name)
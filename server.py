@@ -0,0 +1,493 @@
+import argparse
+import asyncio
+import json
+import os
+import re
+import secrets
+import time
+from http import HTTPStatus
+from typing import Dict, List, Optional, Set
+from urllib.parse import parse_qs, urlsplit
+
+from sd.job_queue import sd_queue
+from utils.character_loader import list_characters, load_character
+from utils.chat_logic import arun_turn, build_character_chain, build_narrator_chain, memory_registry, open_memory
+from utils.llm_registry import registry_stats
+from utils.story_card_loader import load_predefined_cards, story_card_snippets
+from utils.transcript import Transcript
+from utils.user_data import load_user, update_user_tags
+
+# ---------------------------------------------------------------------------
+#   Headless chat server
+# ---------------------------------------------------------------------------
+#   python server.py --port 8000
+# Runs chats without Tk. A session is a Transcript plus its two chains, and
+# every turn is chat_logic.arun_turn awaited on one asyncio loop, so open
+# chats waiting on Ollama cost no threads. Plain HTTP/1.1 with JSON bodies;
+# token streams are Server-Sent Events ("event: <kind>\ndata: <json>").
+#   GET    /characters                        catalog records
+#   POST   /sessions                          {"username", "ip", "path", "chat"?,
+#                                              "story_cards"?: [card, …], "extras"?: bool}
+#   GET    /sessions/<id>                     the transcript
+#   DELETE /sessions/<id>
+#   POST   /sessions/<id>/turn                {"text"}             → SSE
+#   POST   /sessions/<id>/regenerate          {"instructions"?}    → SSE
+#   POST   /sessions/<id>/continue            {}                   → SSE
+#   GET    /sessions/<id>/events              SSE: scene images as they finish
+#   GET    /sessions/<id>/turns/<tid>/image   PNG (?version=n, default active)
+#   GET    /stats
+# A turn stream ends with "finished"; the scene image follows later on
+# /events because rendering runs after the reply. One turn per session at a
+# time (409 otherwise). Memory belongs to (username, character, chat): sessions
+# opened with the same "chat" share it, and it outlives them in users/memory.db
+# (idle ones are hibernated, see utils/memory_registry.py). A session nobody
+# has touched for SESSION_IDLE_TIMEOUT seconds (default 3600) and that has no
+# turn running and no /events listener is dropped; its memory stays.
+# ---------------------------------------------------------------------------
+
+MAX_BODY = 1024 * 1024            # bytes accepted in a request body
+SSE_PING = 15.0                   # seconds between keep-alive comments on /events
+SESSION_IDLE_TIMEOUT = float(os.getenv("SESSION_IDLE_TIMEOUT", "3600"))
+
+
+class HTTPError(Exception):
+    def __init__(self, status: int, message: str = ""):
+        super().__init__(message or HTTPStatus(status).phrase)
+        self.status = status
+
+
+class Request:
+    __slots__ = ("method", "path", "query", "headers", "body")
+
+    def __init__(self, method: str, target: str, headers: Dict[str, str], body: bytes):
+        url = urlsplit(target)
+        self.method = method
+        self.path = url.path.rstrip("/") or "/"
+        self.query = {k: v[-1] for k, v in parse_qs(url.query).items()}
+        self.headers = headers
+        self.body = body
+
+    def json(self) -> dict:
+        if not self.body:
+            return {}
+        try:
+            data = json.loads(self.body)
+        except ValueError as exc:
+            raise HTTPError(400, f"invalid JSON: {exc}")
+        if not isinstance(data, dict):
+            raise HTTPError(400, "expected a JSON object")
+        return data
+
+
+async def read_request(reader: asyncio.StreamReader) -> Optional[Request]:
+    """Parse one request; None if the client closed the connection first."""
+    line = await reader.readline()
+    if not line:
+        return None
+    try:
+        method, target, _version = line.decode("latin-1").split()
+    except ValueError:
+        raise HTTPError(400, "malformed request line")
+    headers: Dict[str, str] = {}
+    while True:
+        line = await reader.readline()
+        if line in (b"\r\n", b"\n", b""):
+            break
+        name, _, value = line.decode("latin-1").partition(":")
+        headers[name.strip().lower()] = value.strip()
+    length = int(headers.get("content-length") or 0)
+    if length > MAX_BODY:
+        raise HTTPError(413)
+    body = await reader.readexactly(length) if length else b""
+    return Request(method.upper(), target, headers, body)
+
+
+def _head(status: int, headers: Dict[str, str]) -> bytes:
+    lines = [f"HTTP/1.1 {status} {HTTPStatus(status).phrase}"]
+    lines += [f"{k}: {v}" for k, v in headers.items()]
+    return ("\r\n".join(lines) + "\r\n\r\n").encode("latin-1")
+
+
+async def send_body(writer: asyncio.StreamWriter, status: int, body: bytes, content_type: str):
+    writer.write(_head(status, {
+        "Content-Type": content_type,
+        "Content-Length": str(len(body)),
+        "Connection": "close",
+    }) + body)
+    await writer.drain()
+
+
+async def send_json(writer: asyncio.StreamWriter, status: int, data):
+    body = json.dumps(data, ensure_ascii=False).encode("utf-8")
+    await send_body(writer, status, body, "application/json; charset=utf-8")
+
+
+class EventStream:
+    """Server-Sent Events on one connection. A client that went away is
+    remembered, later sends are dropped, so a turn always runs to the end."""
+
+    def __init__(self, writer: asyncio.StreamWriter):
+        self.writer = writer
+        self.open = True
+
+    async def start(self):
+        self.writer.write(_head(200, {
+            "Content-Type": "text/event-stream; charset=utf-8",
+            "Cache-Control": "no-cache",
+            "Connection": "close",
+        }))
+        await self._drain()
+
+    async def send(self, event: str, data: dict):
+        if self.open:
+            self.writer.write(
+                f"event: {event}\ndata: {json.dumps(data, ensure_ascii=False)}\n\n".encode("utf-8"))
+            await self._drain()
+
+    async def ping(self):
+        if self.open:
+            self.writer.write(b": ping\n\n")
+            await self._drain()
+
+    async def _drain(self):
+        try:
+            await self.writer.drain()
+        except ConnectionError:
+            self.open = False
+
+
+# ── Sessions ────────────────────────────────────────────────────────────────
+class ChatSession:
+    """One chat: character, chains and transcript. Loop thread only."""
+
+    def __init__(self, sid: str, user_data: dict, character: dict):
+        self.id = sid
+        self.user_data = user_data
+        self.character = character
+        self.chain = build_character_chain(character)
+        self.narr_chain = build_narrator_chain(character)
+        self.transcript = Transcript(character["name"], character.get("greeting", ""))
+        self.lock = asyncio.Lock()                 # one turn at a time
+        self.listeners: Set[asyncio.Queue] = set()
+        self.last_used = time.time()
+
+    def idle_for(self, now: float) -> float:
+        """Seconds since last use; 0 while a turn runs or a client listens."""
+        if self.lock.locked() or self.listeners:
+            return 0.0
+        return now - self.last_used
+
+    def snapshot(self) -> dict:
+        turns = []
+        for turn in self.transcript.turns():
+            t = {"id": turn.id, "role": turn.role}
+            if turn.role == "reply":
+                t.update(versions=turn.versions, idx=turn.idx)
+            else:
+                t["text"] = turn.text
+            turns.append(t)
+        return {
+            "id": self.id,
+            "username": self.user_data["username"],
+            "character": self.character["name"],
+            "busy": self.lock.locked(),
+            "turns": turns,
+        }
+
+    def image_url(self, tid: int, idx: int) -> str:
+        return f"/sessions/{self.id}/turns/{tid}/image?version={idx}"
+
+    def publish(self, event: str, data: dict):
+        for q in self.listeners:
+            q.put_nowait((event, data))
+
+    def _image_done(self, tag, path: str):
+        tid, idx = tag
+        if self.transcript.attach_image(tid, idx, path):
+            self.publish("image", {"turn": tid, "version": idx, "url": self.image_url(tid, idx)})
+
+    async def run(self, stream: EventStream, tid: int, user_text: str, context: List[str],
+                  show_narr: bool = True, user_turn: bool = False):
+        """
+        Stream one turn into the active version of reply turn `tid` – the
+        same bookkeeping the Tk chatroom does in begin_turn / pump_events.
+        `context` is the dialogue the turn answers, without the turns
+        added for it.
+        """
+        self.last_used = time.time()
+        tag = (tid, self.transcript.get(tid).idx)
+        loop = asyncio.get_running_loop()
+
+        def _on_image(path: str):   # SD worker thread
+            loop.call_soon_threadsafe(self._image_done, tag, path)
+
+        await stream.send("turn", {"turn": tid, "version": tag[1]})
+        try:
+            async for kind, payload in arun_turn(
+                    self.character, self.chain, self.narr_chain,
+                    context, user_text, on_image=_on_image):
+                if kind == "narr" and show_narr:
+                    self.transcript.append_text(tid, "narr", payload)
+                    await stream.send("narr", {"text": payload})
+                elif kind == "narr_end" and show_narr:
+                    self.transcript.append_text(tid, "narr", "*")
+                    await stream.send("narr_end", {})
+                elif kind == "char":
+                    self.transcript.append_text(tid, "reply", payload)
+                    await stream.send("char", {"text": payload})
+                elif kind == "char_end":
+                    await stream.send("char_end", {})
+                elif kind == "reply":
+                    if user_turn:   # may write the profile to disk
+                        await asyncio.to_thread(update_user_tags, self.user_data, self.character)
+                    cur = self.transcript.get(tid).current
+                    await stream.send("reply", {"turn": tid, "version": tag[1],
+                                                "narr": cur["narr"], "reply": cur["reply"],
+                                                "stats": payload[3]})
+        except Exception as exc:  # Ollama down, chain error, …
+            print(f"⚠️ Turn failed in session {self.id}: {exc}")
+            await stream.send("error", {"error": str(exc)})
+        finally:
+            self.last_used = time.time()
+        await stream.send("finished", {})
+
+
+class ChatServer:
+    def __init__(self, idle_timeout: float = SESSION_IDLE_TIMEOUT):
+        self.idle_timeout = idle_timeout
+        self.sessions: Dict[str, ChatSession] = {}
+        self.users: Dict[str, dict] = {}           # username → profile, shared by its sessions
+        self.routes = [
+            ("GET",    r"/characters",                           self.get_characters),
+            ("GET",    r"/stats",                                self.get_stats),
+            ("POST",   r"/sessions",                             self.create_session),
+            ("GET",    r"/sessions/(?P<sid>\w+)",                self.get_session),
+            ("DELETE", r"/sessions/(?P<sid>\w+)",                self.delete_session),
+            ("POST",   r"/sessions/(?P<sid>\w+)/turn",           self.post_turn),
+            ("POST",   r"/sessions/(?P<sid>\w+)/regenerate",     self.post_regenerate),
+            ("POST",   r"/sessions/(?P<sid>\w+)/continue",       self.post_continue),
+            ("GET",    r"/sessions/(?P<sid>\w+)/events",         self.get_events),
+            ("GET",    r"/sessions/(?P<sid>\w+)/turns/(?P<tid>\d+)/image", self.get_image),
+        ]
+        self.routes = [(m, re.compile(p + r"\Z"), h) for m, p, h in self.routes]
+
+    # ── connection handling ───────────────────────────────────────────────
+    async def handle(self, reader: asyncio.StreamReader, writer: asyncio.StreamWriter):
+        try:
+            try:
+                req = await read_request(reader)
+                if req is not None:
+                    await self.dispatch(req, writer)
+            except HTTPError as exc:
+                await send_json(writer, exc.status, {"error": str(exc)})
+            except (asyncio.IncompleteReadError, ConnectionError):
+                pass
+            except Exception as exc:
+                print(f"⚠️ Request failed: {exc!r}")
+                await send_json(writer, 500, {"error": str(exc)})
+        except ConnectionError:
+            pass
+        finally:
+            writer.close()
+
+    async def dispatch(self, req: Request, writer: asyncio.StreamWriter):
+        allowed = False
+        for method, pattern, handler in self.routes:
+            m = pattern.match(req.path)
+            if not m:
+                continue
+            if method != req.method:
+                allowed = True
+                continue
+            result = await handler(req, writer, **m.groupdict())
+            if result is not None:              # streaming handlers answer themselves
+                status, data = result if isinstance(result, tuple) else (200, result)
+                await send_json(writer, status, data)
+            return
+        raise HTTPError(405 if allowed else 404)
+
+    def _session(self, sid: str) -> ChatSession:
+        session = self.sessions.get(sid)
+        if session is None:
+            raise HTTPError(404, f"no session {sid}")
+        session.last_used = time.time()
+        return session
+
+    def sweep(self) -> int:
+        """Drop sessions idle for longer than `idle_timeout`, and profiles no session uses."""
+        now = time.time()
+        stale = [sid for sid, s in self.sessions.items() if s.idle_for(now) > self.idle_timeout]
+        for sid in stale:
+            del self.sessions[sid]
+        in_use = {s.user_data["username"] for s in self.sessions.values()}
+        for username in [u for u in self.users if u not in in_use]:
+            del self.users[username]
+        return len(stale)
+
+    async def run_sweeper(self):
+        interval = min(60.0, max(1.0, self.idle_timeout / 4))
+        while True:
+            await asyncio.sleep(interval)
+            self.sweep()
+
+    async def _stream_turn(self, writer, session: ChatSession, tid: int, text: str,
+                           context: List[str], **kw):
+        stream = EventStream(writer)
+        await stream.start()
+        await session.run(stream, tid, text, context, **kw)
+
+    @staticmethod
+    def _claim(session: ChatSession):
+        if session.lock.locked():
+            raise HTTPError(409, "a turn is already running in this session")
+
+    # ── handlers ──────────────────────────────────────────────────────────
+    async def get_characters(self, req, writer):
+        records = await asyncio.to_thread(list_characters)
+        return [{"ip": r.ip, "path": r.path, "name": r.name, "tags": r.tags} for r in records]
+
+    async def get_stats(self, req, writer):
+        return {
+            "sessions": len(self.sessions),
+            "busy": sum(s.lock.locked() for s in self.sessions.values()),
+            "llm": registry_stats(),
+            "memory": memory_registry.session_stats(),
+            "sd": sd_queue.queue_stats(),
+        }
+
+    async def create_session(self, req, writer):
+        body = req.json()
+        try:
+            username, ip, path = body["username"], body["ip"], body["path"]
+        except KeyError as exc:
+            raise HTTPError(400, f"missing field {exc}")
+        try:
+            character = await asyncio.to_thread(load_character, ip, path)
+        except ValueError as exc:
+            raise HTTPError(404, str(exc))
+        character = dict(character, ip=ip)
+
+        cards = await asyncio.to_thread(load_predefined_cards, ip) if body.get("extras", True) else []
+        cards += [c for c in body.get("story_cards") or [] if isinstance(c, dict)]
+        if cards:
+            character["story_cards"] = story_card_snippets(cards)
+
+        user_data = self.users.get(username)
+        if user_data is None:
+            user_data = self.users[username] = await asyncio.to_thread(load_user, username)
+        await asyncio.to_thread(open_memory, username, character, str(body.get("chat", "")))
+
+        sid = secrets.token_hex(8)
+        session = self.sessions[sid] = ChatSession(sid, user_data, character)
+        return 201, session.snapshot()
+
+    async def get_session(self, req, writer, sid):
+        return self._session(sid).snapshot()
+
+    async def delete_session(self, req, writer, sid):
+        session = self.sessions.pop(sid, None)
+        if session is None:
+            raise HTTPError(404, f"no session {sid}")
+        session.publish("closed", {})
+        return {"deleted": sid}
+
+    async def post_turn(self, req, writer, sid):
+        session = self._session(sid)
+        text = str(req.json().get("text", "")).strip()
+        if not text:
+            raise HTTPError(400, "empty message – use /continue or /regenerate")
+        self._claim(session)
+        async with session.lock:
+            user = session.transcript.add_user(text)
+            reply = session.transcript.add_reply()
+            session.transcript.new_version(reply.id)
+            context = session.transcript.pieces(before=user.id)
+            await self._stream_turn(writer, session, reply.id, text, context, user_turn=True)
+
+    async def post_regenerate(self, req, writer, sid):
+        session = self._session(sid)
+        extra = str(req.json().get("instructions", "")).strip()
+        self._claim(session)
+        async with session.lock:
+            reply = session.transcript.last("reply")
+            if reply is None:
+                raise HTTPError(409, "nothing to regenerate")
+            last_user = session.transcript.last("user", before=reply.id)
+            text = (last_user.text if last_user else "") + (f"\n\n{extra}" if extra else "")
+            session.transcript.new_version(reply.id)
+            # the user message is the input, so the history stops before it
+            context = session.transcript.pieces(before=(last_user or reply).id)
+            await self._stream_turn(writer, session, reply.id, text, context)
+
+    async def post_continue(self, req, writer, sid):
+        session = self._session(sid)
+        self._claim(session)
+        async with session.lock:
+            reply = session.transcript.last("reply")
+            if reply is None or reply.current is None:
+                raise HTTPError(409, "nothing to continue")
+            # the reply being continued stays in the context
+            context = session.transcript.pieces()
+            await self._stream_turn(writer, session, reply.id, "", context, show_narr=False)
+
+    async def get_events(self, req, writer, sid):
+        session = self._session(sid)
+        stream = EventStream(writer)
+        await stream.start()
+        q: asyncio.Queue = asyncio.Queue()
+        session.listeners.add(q)
+        try:
+            while stream.open:
+                try:
+                    event, data = await asyncio.wait_for(q.get(), SSE_PING)
+                except asyncio.TimeoutError:
+                    await stream.ping()         # also notices a client that left
+                    continue
+                await stream.send(event, data)
+                if event == "closed":
+                    break
+        finally:
+            session.listeners.discard(q)
+
+    async def get_image(self, req, writer, sid, tid):
+        session = self._session(sid)
+        try:
+            turn = session.transcript.get(int(tid))
+            idx = int(req.query.get("version", turn.idx))
+            version = turn.versions[idx] if idx >= 0 else None
+        except (KeyError, IndexError, ValueError):
+            raise HTTPError(404, "no such reply version")
+        path = (version or {}).get("image")
+        if not path or not os.path.exists(path):
+            raise HTTPError(404, "no image yet")
+        data = await asyncio.to_thread(_read_file, path)
+        await send_body(writer, 200, data, "image/png")
+
+
+def _read_file(path: str) -> bytes:
+    with open(path, "rb") as f:
+        return f.read()
+
+
+async def serve(host: str = "127.0.0.1", port: int = 8000):
+    server = ChatServer()
+    listener = await asyncio.start_server(server.handle, host, port)
+    print(f"✅ Chat server listening on http://{host}:{port}")
+    sweeper = asyncio.create_task(server.run_sweeper()) if server.idle_timeout > 0 else None
+    try:
+        async with listener:
+            await listener.serve_forever()
+    finally:
+        if sweeper is not None:
+            sweeper.cancel()
+
+
+if __name__ == "__main__":
+    parser = argparse.ArgumentParser(description="Headless chat server (no Tk)")
+    parser.add_argument("--host", default=os.getenv("CHAT_HOST", "127.0.0.1"))
+    parser.add_argument("--port", type=int, default=int(os.getenv("CHAT_PORT", "8000")))
+    args = parser.parse_args()
+    try:
+        asyncio.run(serve(args.host, args.port))
+    except KeyboardInterrupt:
+        pass
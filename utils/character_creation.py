@@ -2,10 +2,7 @@ import os
 import json
 import tkinter as tk
 from tkinter import ttk, messagebox, Toplevel
-from utils.character_loader import get_ips
-
-# Root directory for character JSON files
-CHARACTER_ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'characters')
+from utils.character_loader import CHARACTER_ROOT_DIR, catalog, get_ips
 
 # This function creates a new character JSON file under IP and optional unit/folder
 def create_character(ip_name, character_data, unit_folder=None):
@@ -27,6 +24,8 @@ def create_character(ip_name, character_data, unit_folder=None):
     with open(file_path, "w", encoding="utf-8") as f:
         json.dump(character_data, f, indent=4)
 
+    # keep the catalog current without rescanning /characters
+    catalog.add(ip_name, f"{unit_folder}/{char_name}" if unit_folder else char_name)
     return char_name
 
 # This function creates the character creation popup window
@@ -1,42 +1,227 @@
 import json
 import os
+import threading
+import time
+from typing import Dict, List, Optional, Tuple
 
 CHARACTER_ROOT_DIR = os.path.join(os.path.dirname(__file__), '..', 'characters')
 
+# ---------------------------------------------------------------------------
+#   Character catalog
+# ---------------------------------------------------------------------------
+# Keeps a compact metadata record (ip, path, name, tags + the file's mtime
+# and size) per character – never the persona text. The records are saved to
+# a sidecar file, so a restart only has to stat the files; a file is parsed
+# again only when it changed or appeared. Scans closer than `min_interval`
+# apart (one homepage build asks several times) are skipped altogether.
+# Full character bodies are read from disk on demand (load_character), i.e.
+# when a chat is entered. create_character() adds its new file directly.
+# Folders that are not characters (story cards, caches) are skipped.
+# ---------------------------------------------------------------------------
+
+_SKIP_DIRS = {"__pycache__", "_extras"}
+SIDECAR_FILE = ".catalog.json"
+_SIDECAR_VERSION = 1
+
+
+class CharacterMeta:
+    """What the homepage and the recommender need about one character."""
+    __slots__ = ("ip", "path", "name", "tags", "mtime", "size")
+
+    def __init__(self, ip: str, path: str, name: str, tags: List[str], mtime: int, size: int):
+        self.ip = ip
+        self.path = path
+        self.name = name
+        self.tags = tags
+        self.mtime = mtime
+        self.size = size
+
+    # dict-style access, so code written against the full JSON keeps working
+    def __getitem__(self, key: str):
+        try:
+            return getattr(self, key)
+        except AttributeError:
+            raise KeyError(key) from None
+
+    def get(self, key: str, default=None):
+        return getattr(self, key, default)
+
+
+class CharacterCatalog:
+    """(ip, relative path) → CharacterMeta, kept in sync with disk."""
+
+    def __init__(self, root: str = CHARACTER_ROOT_DIR, min_interval: float = 1.0):
+        self.root = root
+        self.min_interval = min_interval
+        self._scanned = 0.0
+        self._lock = threading.RLock()
+        self._ips: List[str] = []
+        self._meta: Dict[Tuple[str, str], CharacterMeta] = {}
+        self._dirty = False
+        self._loaded = False
+        self.stats = {"scans": 0, "parsed": 0}
+
+    def _file(self, ip: str, rel_path: str) -> str:
+        return os.path.join(self.root, ip, f"{rel_path}.json")
+
+    # ── sidecar ────────────────────────────────────────────────────────────
+    def _load_sidecar(self):
+        if self._loaded:
+            return
+        self._loaded = True
+        try:
+            with open(os.path.join(self.root, SIDECAR_FILE), "r", encoding="utf-8") as f:
+                blob = json.load(f)
+        except (OSError, ValueError):
+            return
+        if blob.get("version") != _SIDECAR_VERSION:
+            return
+        for ip, path, name, tags, mtime, size in blob.get("entries", []):
+            self._meta[(ip, path)] = CharacterMeta(ip, path, name, tags, mtime, size)
+
+    def _save_sidecar(self):
+        if not self._dirty:
+            return
+        entries = [[m.ip, m.path, m.name, m.tags, m.mtime, m.size] for m in self._meta.values()]
+        path = os.path.join(self.root, SIDECAR_FILE)
+        try:
+            with open(path + ".tmp", "w", encoding="utf-8") as f:
+                json.dump({"version": _SIDECAR_VERSION, "entries": entries}, f, ensure_ascii=False)
+            os.replace(path + ".tmp", path)
+            self._dirty = False
+        except OSError as exc:  # read-only install – the in-memory index still works
+            print(f"⚠️ Cannot write character index: {exc}")
+
+    # ── scanning ───────────────────────────────────────────────────────────
+    def _read(self, ip: str, rel_path: str) -> Optional[dict]:
+        try:
+            with open(self._file(ip, rel_path), "r", encoding="utf-8") as f:
+                return json.load(f)
+        except (OSError, ValueError) as exc:
+            print(f"⚠️ Cannot load character {ip}/{rel_path}: {exc}")
+            return None
+
+    def _index(self, key: Tuple[str, str], sig: Tuple[int, int], data: Optional[dict] = None) -> Optional[dict]:
+        """(Re-)build the record for `key`; parses the file unless `data` is given."""
+        if data is None:
+            data = self._read(*key)
+            if data is None:
+                return None
+        tags = data.get("tags")
+        self._meta[key] = CharacterMeta(
+            key[0], key[1], data.get("name", os.path.basename(key[1])),
+            list(tags) if isinstance(tags, list) else [], sig[0], sig[1])
+        self._dirty = True
+        self.stats["parsed"] += 1
+        return data
+
+    def _walk(self, ip: str, base: str, prefix: str, seen: set):
+        try:
+            entries = list(os.scandir(base))
+        except OSError:
+            return
+        for entry in entries:
+            if entry.is_dir():
+                if entry.name not in _SKIP_DIRS:
+                    self._walk(ip, entry.path, f"{prefix}{entry.name}/", seen)
+            elif entry.name.endswith(".json"):
+                key = (ip, prefix + entry.name[:-5])
+                st = entry.stat()
+                seen.add(key)
+                meta = self._meta.get(key)
+                if meta is None or (meta.mtime, meta.size) != (st.st_mtime_ns, st.st_size):
+                    self._index(key, (st.st_mtime_ns, st.st_size))
+
+    def refresh(self, force: bool = False):
+        """Stat every file, re-index new/changed ones, forget deleted ones."""
+        with self._lock:
+            if not force and time.monotonic() - self._scanned < self.min_interval:
+                return
+            self._load_sidecar()
+            self.stats["scans"] += 1
+            ips, seen = [], set()
+            for entry in os.scandir(self.root):
+                if entry.is_dir() and entry.name not in _SKIP_DIRS:
+                    ips.append(entry.name)
+                    self._walk(entry.name, entry.path, "", seen)
+            self._ips = sorted(ips)
+            for key in set(self._meta) - seen:
+                del self._meta[key]
+                self._dirty = True
+            self._save_sidecar()
+            self._scanned = time.monotonic()
+
+    def add(self, ip: str, rel_path: str) -> Optional[dict]:
+        """Index one (new or rewritten) character file without a rescan; returns its body."""
+        key = (ip, rel_path)
+        with self._lock:
+            self._load_sidecar()
+            try:
+                st = os.stat(self._file(ip, rel_path))
+            except OSError:
+                if self._meta.pop(key, None) is not None:
+                    self._dirty = True
+                    self._save_sidecar()
+                return None
+            if ip not in self._ips:
+                self._ips = sorted(self._ips + [ip])
+            data = self._read(ip, rel_path)
+            meta = self._meta.get(key)
+            if data is not None and (meta is None or (meta.mtime, meta.size) != (st.st_mtime_ns, st.st_size)):
+                self._index(key, (st.st_mtime_ns, st.st_size), data)
+                self._save_sidecar()
+            return data
+
+    # ── reads ──────────────────────────────────────────────────────────────
+    def ips(self) -> List[str]:
+        with self._lock:
+            return list(self._ips)
+
+    def paths(self, ip: str) -> List[str]:
+        with self._lock:
+            return sorted(rel for i, rel in self._meta if i == ip)
+
+    def records(self) -> List[CharacterMeta]:
+        with self._lock:
+            return [self._meta[key] for key in sorted(self._meta)]
+
+    def get(self, ip: str, rel_path: str) -> Optional[dict]:
+        """Full character body straight from disk (its record is refreshed too)."""
+        return self.add(ip, rel_path)
+
+
+catalog = CharacterCatalog()
+
+
 def get_ips():
     """List all IP folders under /characters"""
-    return sorted([
-        d for d in os.listdir(CHARACTER_ROOT_DIR)
-        if os.path.isdir(os.path.join(CHARACTER_ROOT_DIR, d)) and d != "__pycache__"
-    ])
+    catalog.refresh()
+    return catalog.ips()
 
 def get_characters_by_ip(ip_name):
-    """Recursively find all .json character files under an IP"""
-    ip_dir = os.path.join(CHARACTER_ROOT_DIR, ip_name)
-    characters = []
-    for root, _, files in os.walk(ip_dir):
-        for file in files:
-            if file.endswith(".json"):
-                rel_path = os.path.relpath(os.path.join(root, file), ip_dir)
-                char_name = os.path.splitext(rel_path)[0].replace("\\", "/")  # For nested folders
-                characters.append(char_name)
-    return sorted(characters)
+    """All character paths under an IP, nested folders as "unit/name" """
+    catalog.refresh()
+    return catalog.paths(ip_name)
+
+def list_characters() -> List[CharacterMeta]:
+    """Metadata records (ip, path, name, tags) of every character – no bodies"""
+    catalog.refresh()
+    return catalog.records()
 
 def load_character(ip_name, character_path):
     """Load character using nested folder-aware path"""
-    json_path = os.path.join(CHARACTER_ROOT_DIR, ip_name, f"{character_path}.json")
-    if not os.path.exists(json_path):
+    data = catalog.get(ip_name, character_path)
+    if data is None:
+        json_path = os.path.join(CHARACTER_ROOT_DIR, ip_name, f"{character_path}.json")
         raise ValueError(f"Character '{character_path}' not found in IP '{ip_name}' at {json_path}")
-    with open(json_path, 'r', encoding='utf-8') as f:
-        return json.load(f)
+    return data
 
 def load_all_characters():
-    """Load all characters across all IPs and units"""
+    """Load all characters across all IPs and units (full bodies – prefer list_characters)"""
     characters = []
-    for ip in get_ips():
-        for rel_path in get_characters_by_ip(ip):
-            data = load_character(ip, rel_path)
-            data['ip'] = ip
-            data['path'] = rel_path  # Save relative path for loading again
-            characters.append(data)
+    for meta in list_characters():
+        data = load_character(meta.ip, meta.path)
+        data['ip'] = meta.ip
+        data['path'] = meta.path  # Save relative path for loading again
+        characters.append(data)
     return characters
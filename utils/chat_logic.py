@@ -1,153 +1,699 @@
-from typing import List, Tuple, Dict
-from langchain_ollama import OllamaLLM
-from langchain_core.prompts import ChatPromptTemplate
-from utils.memory import MemoryManager
-
-# ── instantiate a single MemoryManager ────────────────────────────────────────
-memory = MemoryManager(model_name="llama3.2")
-
-
-# ── Character Logic ──────────────────────────────────────────────────────────
-def build_character_chain(ch: dict):
-    """
-    Returns an LLMChain that plays the character.
-    """
-    model = OllamaLLM(model="llama3")
-
-    # static fields are f-stringed; {context} and {user_input} remain as ChatPromptTemplate slots
-    prompt_text = f"""You are a character in a visual novel. You may respond in any style, but it must align with your character’s personality.
-
-Character name: {ch['name']}
-Character background: {ch.get('background', '')}
-Persona: {ch['style']['description']}
-Speaking style: {ch['style']['type']}
-
-Context:
-{{context}}
-User: {{user_input}}
-{ch['name']}: """
-
-    prompt = ChatPromptTemplate.from_template(prompt_text)
-    return prompt | model
-
-
-def stream_character_reply(chain, context: str, user_input: str):
-    """
-    Stream tokens for the character’s reply.
-    """
-    return chain.stream({"context": context, "user_input": user_input})
-
-
-# ── Narrator Logic ───────────────────────────────────────────────────────────
-def build_narrator_chain(ch: dict):
-    """
-    Returns an LLMChain that plays the uncensored narrator.
-    """
-    model = OllamaLLM(model="llama3")  # or your uncensored model
-
-    prompt_text = f"""
-You are a narrator in a visual novel.
-
-Your role is to describe the physical scene and the character's emotional actions.
-Focus on body language, subtle changes in behavior, or shifts in tone.
-Only describe; do NOT include any spoken dialogue.
-Return output wrapped in asterisks, e.g. *She smiles and looks away.*
-
-Character:
-- Name: {ch['name']}
-- Style: {ch['style']['type']}
-- Description: {ch['style']['description']}
-
-Conversation so far:
-{{context}}
-
-User just said:
-{{user_input}}
-
-Narrator:"""
-
-    prompt = ChatPromptTemplate.from_template(prompt_text)
-    return prompt | model
-
-
-def stream_narration(chain, context: str, user_input: str):
-    """
-    Stream tokens for the narrator’s description.
-    """
-    return chain.stream({"context": context, "user_input": user_input})
-
-
-# ── Context + Memory Helpers ─────────────────────────────────────────────────
-def get_extended_context(raw_context: str, user_input: str) -> str:
-    """
-    Prefix the raw dialogue with the current rolling summary and
-    the top-5 most relevant extracted facts.
-    """
-    # 1) Rolling summary
-    mem_sum = memory.summary or "(no summary yet)"
-
-    # 2) Top-5 relevant facts
-    hits = memory.get_relevant_facts(user_input, top_k=5)
-    if hits:
-        facts_str = "\n".join(f"{f['type'].capitalize()}: {f['text']}" for f in hits)
-    else:
-        facts_str = "(no relevant facts)"
-
-    prefix = (
-        f"Memories summary:\n{mem_sum}\n\n"
-        f"Relevant facts:\n{facts_str}\n\n"
-    )
-    return prefix + raw_context
-
-
-def process_turn(
-    character: dict,
-    chain,
-    narr_chain,
-    raw_context: str,
-    user_input: str
-) -> Tuple[List[str], List[str], str]:
-    """
-    Do one full turn:
-      1) Build extended context (with memory)
-      2) Stream narrator → collect tokens
-      3) Stream character → collect tokens
-      4) Update memory (summary & facts)
-      5) Return (narr_tokens, char_tokens, new_context)
-
-    new_context is raw_context plus:
-      "\n\nUser: {user_input}\n{character['name']}: {full_reply}"
-    """
-    # 1) Extend context
-    ext_ctx = get_extended_context(raw_context, user_input)
-
-    # 2) Narration
-    narr_tokens = list(stream_narration(narr_chain, ext_ctx, user_input))
-
-    # 3) Character reply
-    char_tokens = list(stream_character_reply(chain, ext_ctx, user_input))
-    full_reply = "".join(char_tokens)
-
-    # 4) Update memory
-    memory.update_summary(user_input, full_reply)
-    memory.extract_facts(user_input, full_reply)
-
-    # txt to image
-    from sd.prompt import generate_sd_prompt  #
-    from utils.memory import MemoryManager  #
-    mem = MemoryManager()  #
-    result = generate_sd_prompt(mem, ch=character)  #
-    print(result)  #
-
-    from sd.sd_test import generate_image_from_json  #
-    generate_image_from_json("prompt.json", output_name=f"{character['name']}_turn.png")  #
-
-
-    # 5) Append to raw context
-    new_context = (
-        raw_context
-        + f"\n\nUser: {user_input}\n"
-        + f"{character['name']}: {full_reply}"
-    )
-
-    return narr_tokens, char_tokens, new_context
+import asyncio
+import os
+import queue
+import threading
+import time
+from collections import OrderedDict
+from typing import AsyncIterator, Callable, Iterator, List, Optional, Tuple, Dict
+from langchain_core.prompts import ChatPromptTemplate
+from utils.context_builder import ContextAssembler, context_window
+from utils.llm_registry import get_llm
+from utils.memory import MemoryManager
+from utils.memory_registry import MemoryRegistry
+from utils.memory_store import MemoryStore
+from utils.character_loader import get_characters_by_ip
+from sd.image_cache import cache_key, image_cache
+from sd.job_queue import sd_queue
+from sd.scene import SceneTracker
+
+CHAT_MODEL = "llama3"
+
+# ── one MemoryManager per (user, character, chat) ────────────────────────────
+# Idle ones are hibernated to the store and restored on next use
+# (utils/memory_registry.py).
+memory_store = MemoryStore()   # users/memory.db – survives restarts
+memory_registry = MemoryRegistry(memory_store, model_name="llama3.2")
+
+
+def open_memory(username: str, character: dict, chat: str = "") -> MemoryManager:
+    """
+    Tie this chat's `character` dict to the memory of (user, character,
+    chat), restoring its summary and facts from the store.
+    """
+    character["session"] = (username, character["name"], chat)
+    return memory_registry.get(*character["session"])
+
+
+def session_key(character: dict) -> Tuple[str, str, str]:
+    """(user, character, chat) set by open_memory; anonymous default chat otherwise."""
+    return tuple(character.get("session") or ("", character["name"], ""))
+
+
+def session_memory(character: dict) -> MemoryManager:
+    """The chat's memory, restored first if it was hibernated."""
+    return memory_registry.get(*session_key(character))
+
+
+# ── Context budget ───────────────────────────────────────────────────────────
+# Fills num_ctx of CHAT_MODEL: persona → summary → facts → recent turns.
+assembler = ContextAssembler(model=CHAT_MODEL)
+
+
+# ── Prompt Layout ────────────────────────────────────────────────────────────
+# "prefix" (default): everything static about the character – persona,
+# background, style, story cards – comes first and is byte-identical every
+# turn, followed by the dialogue (append-only, so it only grows at the end)
+# and only then the volatile memory summary/facts and the user input.
+# Ollama reuses the KV cache of the longest unchanged prompt prefix, so a turn
+# only prefills the new dialogue and the memory block instead of the whole
+# persona. "legacy": memory right after the persona, as before.
+PROMPT_LAYOUT = os.environ.get("CHAT_PROMPT_LAYOUT", "prefix")
+
+# Both chat chains use identical options so they share one loaded runner
+# (changing options forces a reload), and keep_alive keeps that runner and
+# its cache slots resident between turns instead of Ollama's 5 min default.
+# With OLLAMA_NUM_PARALLEL >= 2 narrator and character each keep their own
+# slot, because Ollama routes a request to the slot with the longest
+# matching prefix.
+CHAT_LLM_OPTIONS = {
+    "num_ctx":    context_window(CHAT_MODEL),
+    "keep_alive": os.environ.get("CHAT_KEEP_ALIVE", "30m"),
+}
+
+# The SD prompt runs on the chat model by default, with the same options so
+# a scene render does not reload the chat runner and drop its cache. Set
+# SD_PROMPT_MODEL to move it to another (e.g. smaller) model instead.
+SD_PROMPT_MODEL = os.environ.get("SD_PROMPT_MODEL", CHAT_MODEL)
+SD_PROMPT_OPTIONS = CHAT_LLM_OPTIONS if SD_PROMPT_MODEL == CHAT_MODEL else None
+
+
+def _escape(text: str) -> str:
+    """Make static text safe to inline into a ChatPromptTemplate."""
+    return text.replace("{", "{{").replace("}", "}}")
+
+
+def story_cards_text(ch: dict) -> str:
+    """
+    Story-card snippets picked for this chat (see gui_setup.enter_chat).
+    """
+    cards = ch.get("story_cards") or []
+    return "World info:\n" + "\n".join(cards) + "\n" if cards else ""
+
+
+def _chain_vars(context, user_input: str) -> dict:
+    """`context` is either the legacy context string or get_prompt_vars()."""
+    if isinstance(context, dict):
+        return {**context, "user_input": user_input}
+    return {"context": context, "user_input": user_input}
+
+
+# ── Character Logic ──────────────────────────────────────────────────────────
+def character_persona(ch: dict) -> str:
+    """
+    The static persona header of the character prompt.
+    """
+    return f"""You are a character in a visual novel. You may respond in any style, but it must align with your character’s personality.
+
+Character name: {ch['name']}
+Character background: {ch.get('background', '')}
+Persona: {ch['style']['description']}
+Speaking style: {ch['style']['type']}
+{story_cards_text(ch)}"""
+
+
+def build_character_chain(ch: dict):
+    """
+    Returns an LLMChain that plays the character.
+    """
+    model = get_llm(CHAT_MODEL, **CHAT_LLM_OPTIONS)
+
+    # static fields are f-stringed; {context} and {user_input} remain as ChatPromptTemplate slots
+    if PROMPT_LAYOUT == "prefix":
+        prompt_text = f"""{_escape(character_persona(ch))}
+Conversation so far:
+{{history}}
+
+{{memory}}User: {{user_input}}
+{_escape(ch['name'])}: """
+    else:
+        prompt_text = f"""{_escape(character_persona(ch))}
+Context:
+{{context}}
+User: {{user_input}}
+{_escape(ch['name'])}: """
+
+    prompt = ChatPromptTemplate.from_template(prompt_text)
+    return prompt | model
+
+
+def stream_character_reply(chain, context, user_input: str):
+    """
+    Stream tokens for the character’s reply.
+    """
+    return chain.stream(_chain_vars(context, user_input))
+
+
+def astream_character_reply(chain, context, user_input: str):
+    """
+    Async version of stream_character_reply.
+    """
+    return chain.astream(_chain_vars(context, user_input))
+
+
+# ── Narrator Logic ───────────────────────────────────────────────────────────
+def build_narrator_chain(ch: dict):
+    """
+    Returns an LLMChain that plays the uncensored narrator.
+    """
+    model = get_llm(CHAT_MODEL, **CHAT_LLM_OPTIONS)  # or your uncensored model
+
+    header = f"""
+You are a narrator in a visual novel.
+
+Your role is to describe the physical scene and the character's emotional actions.
+Focus on body language, subtle changes in behavior, or shifts in tone.
+Only describe; do NOT include any spoken dialogue.
+Return output wrapped in asterisks, e.g. *She smiles and looks away.*
+
+Character:
+- Name: {ch['name']}
+- Style: {ch['style']['type']}
+- Description: {ch['style']['description']}
+{story_cards_text(ch)}"""
+
+    if PROMPT_LAYOUT == "prefix":
+        prompt_text = f"""{_escape(header)}
+Conversation so far:
+{{history}}
+
+{{memory}}User just said:
+{{user_input}}
+
+Narrator:"""
+    else:
+        prompt_text = f"""{_escape(header)}
+Conversation so far:
+{{context}}
+
+User just said:
+{{user_input}}
+
+Narrator:"""
+
+    prompt = ChatPromptTemplate.from_template(prompt_text)
+    return prompt | model
+
+
+def stream_narration(chain, context, user_input: str):
+    """
+    Stream tokens for the narrator’s description.
+    """
+    return chain.stream(_chain_vars(context, user_input))
+
+
+def astream_narration(chain, context, user_input: str):
+    """
+    Async version of stream_narration.
+    """
+    return chain.astream(_chain_vars(context, user_input))
+
+
+# ── Turn Concurrency ─────────────────────────────────────────────────────────
+# Narrator and character chains read the same context and never need each
+# other's output, so by default both are started at once and the turn takes
+# roughly as long as the slower of the two. On a single-slot Ollama server
+# (OLLAMA_NUM_PARALLEL=1) the second request would only queue behind the
+# first, so set CHAT_CONCURRENT_TURNS=0 to stream them one after the other.
+CONCURRENT_TURNS = os.environ.get("CHAT_CONCURRENT_TURNS", "1") != "0"
+
+_STREAM_DONE = object()
+
+
+def _timed(kind: str, tokens, stats: Dict[str, object]):
+    """
+    Pass tokens through, recording the chain's time-to-first-token, i.e. the
+    prefill latency we pay, in stats["<kind>_ttft"] (seconds).
+    """
+    t0 = time.perf_counter()
+    first = True
+    for tok in tokens:
+        if first:
+            stats[f"{kind}_ttft"] = time.perf_counter() - t0
+            first = False
+        yield tok
+
+
+def _pump_stream(kind: str, stream_fn, chain, context, user_input: str, out: queue.Queue,
+                 stats: Dict[str, object]):
+    """
+    Worker body: push ("kind", token) pairs from one chain onto `out`.
+    """
+    try:
+        for tok in _timed(kind, stream_fn(chain, context, user_input), stats):
+            out.put((kind, tok))
+    except Exception as exc:  # re-raised on the consumer side
+        out.put((kind, exc))
+    finally:
+        out.put((kind, _STREAM_DONE))
+
+
+def stream_turn(
+    chain,
+    narr_chain,
+    context,
+    user_input: str,
+    concurrent: bool | None = None,
+    stats: Optional[Dict[str, object]] = None
+) -> Iterator[Tuple[str, str]]:
+    """
+    Stream narrator and character tokens as ("narr", tok) / ("char", tok) pairs.
+    When a chain finishes, ("narr_end", "") / ("char_end", "") is yielded.
+
+    In concurrent mode both chains run in worker threads and the pairs are
+    yielded in arrival order, so the two streams may interleave. Otherwise the
+    narration is streamed to completion before the character reply starts.
+    `stats`, if given, receives the layout and both chains' time-to-first-token.
+    """
+    if concurrent is None:
+        concurrent = CONCURRENT_TURNS
+    stats = {} if stats is None else stats
+    stats["layout"] = PROMPT_LAYOUT
+
+    if not concurrent:
+        for tok in _timed("narr", stream_narration(narr_chain, context, user_input), stats):
+            yield "narr", tok
+        yield "narr_end", ""
+        for tok in _timed("char", stream_character_reply(chain, context, user_input), stats):
+            yield "char", tok
+        yield "char_end", ""
+        return
+
+    out: queue.Queue = queue.Queue()
+    workers = [
+        threading.Thread(target=_pump_stream, daemon=True,
+                         args=("narr", stream_narration, narr_chain, context, user_input, out, stats)),
+        threading.Thread(target=_pump_stream, daemon=True,
+                         args=("char", stream_character_reply, chain, context, user_input, out, stats)),
+    ]
+    for w in workers:
+        w.start()
+
+    pending = len(workers)
+    while pending:
+        kind, item = out.get()
+        if item is _STREAM_DONE:
+            pending -= 1
+            yield f"{kind}_end", ""
+        elif isinstance(item, Exception):
+            raise item
+        else:
+            yield kind, item
+
+
+# ── Context + Memory Helpers ─────────────────────────────────────────────────
+def _read_memory(character: Optional[dict], user_input: str,
+                 memory: Optional[MemoryManager] = None) -> Tuple[str, List[Dict[str, str]]]:
+    """Summary + top-5 facts of the character's chat; nothing without a character."""
+    if character is None:
+        return "", []
+    return (memory or session_memory(character)).read_context(user_input, top_k=5)
+
+
+def get_extended_context(
+    raw_context: str | List[str],
+    user_input: str,
+    character: Optional[dict] = None,
+    stats: Optional[Dict[str, object]] = None,
+    memory: Optional[MemoryManager] = None
+) -> str:
+    """
+    Prefix the raw dialogue with the current rolling summary and
+    the top-5 most relevant extracted facts, keeping as many of the most
+    recent dialogue pieces as the model's token budget allows.
+    `raw_context` is the list of dialogue pieces (or one joined string).
+    The token report goes to stats["usage"] if `stats` is given; `memory`
+    defaults to the character's session memory.
+    """
+    # 1) Rolling summary + top-5 relevant facts, read as one snapshot
+    mem_sum, hits = _read_memory(character, user_input, memory)
+
+    # 2) Fit everything into the budget
+    facts = [f"{f['type'].capitalize()}: {f['text']}" for f in hits]
+    turns = raw_context.split("\n\n") if isinstance(raw_context, str) else raw_context
+    persona = character_persona(character) if character else ""
+    ctx, usage = assembler.assemble(persona, mem_sum, facts, turns, user_input)
+    if stats is not None:
+        stats["usage"] = usage
+    return ctx
+
+
+def get_prompt_vars(
+    raw_context: str | List[str],
+    user_input: str,
+    character: Optional[dict] = None,
+    stats: Optional[Dict[str, object]] = None,
+    memory: Optional[MemoryManager] = None
+) -> Dict[str, str]:
+    """
+    Template variables for both chains in the active PROMPT_LAYOUT:
+    {"history", "memory"} for "prefix", {"context"} for "legacy".
+    The token report goes to stats["usage"] if `stats` is given; `memory`
+    defaults to the character's session memory.
+    """
+    if PROMPT_LAYOUT != "prefix":
+        return {"context": get_extended_context(raw_context, user_input, character, stats, memory)}
+
+    mem_sum, hits = _read_memory(character, user_input, memory)
+    facts = [f"{f['type'].capitalize()}: {f['text']}" for f in hits]
+    turns = raw_context.split("\n\n") if isinstance(raw_context, str) else raw_context
+    persona = character_persona(character) if character else ""
+    mem_block, history, usage = assembler.assemble_parts(persona, mem_sum, facts, turns, user_input)
+    if stats is not None:
+        stats["usage"] = usage
+    return {"history": history, "memory": mem_block}
+
+
+def _begin_turn(character: dict, raw_context: str | List[str], user_input: str,
+                stats: Dict[str, object]) -> Tuple[MemoryManager, Dict[str, str]]:
+    """The chat's memory (restored if hibernated) and the prompt vars of its next turn. Blocking."""
+    memory = session_memory(character)
+    return memory, get_prompt_vars(raw_context, user_input, character, stats, memory)
+
+
+def run_turn(
+    character: dict,
+    chain,
+    narr_chain,
+    raw_context: str | List[str],
+    user_input: str,
+    concurrent: bool | None = None,
+    on_image: Optional[Callable[[str], None]] = None
+) -> Iterator[Tuple[str, object]]:
+    """
+    Do one full turn as a stream of (event, payload) pairs:
+      ("narr", tok) / ("char", tok)   tokens as they arrive
+      ("narr_end", "") / ("char_end", "")
+      ("reply", (narr_tokens, char_tokens, new_context, stats))
+
+    `stats` belongs to this turn only: "layout", "narr_ttft" / "char_ttft"
+    (seconds) and "usage", the context assembler's token report.
+
+    The generator ends as soon as the reply is complete. Memory updates and
+    the SD prompt run afterwards on the memory worker, the render on the SD
+    job queue; `on_image(path)` is called from an SD worker thread once the
+    image is written.
+
+    new_context is raw_context plus:
+      "\n\nUser: {user_input}\n{character['name']}: {full_reply}"
+    """
+    # the session stays resident until the turn is queued on its memory
+    with memory_registry.lease(*session_key(character)):
+        # 1) Extend context
+        stats: Dict[str, object] = {}
+        memory, ext_ctx = _begin_turn(character, raw_context, user_input, stats)
+        if not isinstance(raw_context, str):
+            raw_context = "\n\n".join(raw_context)
+
+        # 2+3) Narration and character reply
+        narr_tokens: List[str] = []
+        char_tokens: List[str] = []
+        for kind, tok in stream_turn(chain, narr_chain, ext_ctx, user_input, concurrent, stats):
+            if kind == "narr":
+                narr_tokens.append(tok)
+            elif kind == "char":
+                char_tokens.append(tok)
+            yield kind, tok
+        full_reply = "".join(char_tokens)
+
+        # 4) Append to raw context – the reply is final from here on
+        new_context = (
+            raw_context
+            + f"\n\nUser: {user_input}\n"
+            + f"{character['name']}: {full_reply}"
+        )
+        yield "reply", (narr_tokens, char_tokens, new_context, stats)
+
+        # 5) Update memory in the background, then render the scene
+        _after_turn(character, memory, user_input, narr_tokens, full_reply, on_image)
+
+
+def _after_turn(character: dict, memory: MemoryManager, user_input: str, narr_tokens: List[str],
+                full_reply: str, on_image: Optional[Callable[[str], None]]):
+    """Queue the memory update; the scene render follows on the memory worker. Never blocks."""
+    sid = session_id(character)
+    with _scene_lock:
+        seq = _scene_seq[sid] = _scene_seq.pop(sid, 0) + 1   # re-inserted: most recent last
+        while len(_scene_seq) > SCENE_CAP:
+            del _scene_seq[next(iter(_scene_seq))]
+    scene_text = "\n".join([user_input, "".join(narr_tokens), full_reply])
+    memory.submit_turn(
+        user_input, full_reply,
+        on_done=lambda: _render_scene(character, memory, seq, on_image, scene_text)
+    )
+
+
+# ── Async Turns ──────────────────────────────────────────────────────────────
+# Same turn as above for callers running an event loop (server.py): both
+# chains are awaited with `astream`, so one loop can drive many chats at once
+# without a thread per turn. Only the memory lookup, which may restore the
+# chat's memory from the store and embed the query, is pushed to a worker
+# thread; the manager it returns also takes the finished turn.
+async def _atimed(kind: str, tokens, stats: Dict[str, object]):
+    """Async version of _timed."""
+    t0 = time.perf_counter()
+    first = True
+    async for tok in tokens:
+        if first:
+            stats[f"{kind}_ttft"] = time.perf_counter() - t0
+            first = False
+        yield tok
+
+
+async def astream_turn(
+    chain,
+    narr_chain,
+    context,
+    user_input: str,
+    concurrent: bool | None = None,
+    stats: Optional[Dict[str, object]] = None
+) -> AsyncIterator[Tuple[str, str]]:
+    """
+    Async version of stream_turn, yielding the same pairs. In concurrent mode
+    both chains run as tasks on the current loop.
+    """
+    if concurrent is None:
+        concurrent = CONCURRENT_TURNS
+    stats = {} if stats is None else stats
+    stats["layout"] = PROMPT_LAYOUT
+
+    if not concurrent:
+        async for tok in _atimed("narr", astream_narration(narr_chain, context, user_input), stats):
+            yield "narr", tok
+        yield "narr_end", ""
+        async for tok in _atimed("char", astream_character_reply(chain, context, user_input), stats):
+            yield "char", tok
+        yield "char_end", ""
+        return
+
+    out: asyncio.Queue = asyncio.Queue()
+
+    async def _pump(kind: str, stream_fn, ch):
+        try:
+            async for tok in _atimed(kind, stream_fn(ch, context, user_input), stats):
+                out.put_nowait((kind, tok))
+        except Exception as exc:  # re-raised on the consumer side
+            out.put_nowait((kind, exc))
+        finally:
+            out.put_nowait((kind, _STREAM_DONE))
+
+    tasks = [
+        asyncio.create_task(_pump("narr", astream_narration, narr_chain)),
+        asyncio.create_task(_pump("char", astream_character_reply, chain)),
+    ]
+    try:
+        pending = len(tasks)
+        while pending:
+            kind, item = await out.get()
+            if item is _STREAM_DONE:
+                pending -= 1
+                yield f"{kind}_end", ""
+            elif isinstance(item, Exception):
+                raise item
+            else:
+                yield kind, item
+    finally:
+        for t in tasks:           # consumer gave up or a chain failed
+            t.cancel()
+
+
+async def arun_turn(
+    character: dict,
+    chain,
+    narr_chain,
+    raw_context: str | List[str],
+    user_input: str,
+    concurrent: bool | None = None,
+    on_image: Optional[Callable[[str], None]] = None
+) -> AsyncIterator[Tuple[str, object]]:
+    """
+    Async version of run_turn with the same events. `on_image` is still
+    called from an SD worker thread; hop back onto the loop with
+    `loop.call_soon_threadsafe`.
+    """
+    with memory_registry.lease(*session_key(character)):
+        stats: Dict[str, object] = {}
+        memory, ext_ctx = await asyncio.to_thread(_begin_turn, character, raw_context, user_input, stats)
+        if not isinstance(raw_context, str):
+            raw_context = "\n\n".join(raw_context)
+
+        narr_tokens: List[str] = []
+        char_tokens: List[str] = []
+        async for kind, tok in astream_turn(chain, narr_chain, ext_ctx, user_input, concurrent, stats):
+            if kind == "narr":
+                narr_tokens.append(tok)
+            elif kind == "char":
+                char_tokens.append(tok)
+            yield kind, tok
+        full_reply = "".join(char_tokens)
+
+        new_context = (
+            raw_context
+            + f"\n\nUser: {user_input}\n"
+            + f"{character['name']}: {full_reply}"
+        )
+        yield "reply", (narr_tokens, char_tokens, new_context, stats)
+        _after_turn(character, memory, user_input, narr_tokens, full_reply, on_image)
+
+
+# ── Scene Rendering ──────────────────────────────────────────────────────────
+# Per chat (session_id): the latest turn number and the visual state. Only the
+# most recently used SCENE_CAP chats are kept; a forgotten one just renders
+# its next turn unconditionally.
+SCENE_CAP = 256
+_scene_lock = threading.Lock()
+_scene_seq: Dict[str, int] = {}
+
+# Only re-render when location / outfit / emotion / characters changed
+# (sd/scene.py); "0" renders every turn like before.
+SCENE_GATE = os.environ.get("SD_SCENE_GATE", "1") != "0"
+_scenes: "OrderedDict[str, SceneTracker]" = OrderedDict()
+
+
+def session_id(character: dict) -> str:
+    """String form of session_key, used for the SD queue and scene state."""
+    return "/".join(session_key(character))
+
+
+def scene_tracker(character: dict) -> SceneTracker:
+    """Per-chat visual state; other characters of the same IP count as "present" names."""
+    sid = session_id(character)
+    with _scene_lock:
+        tracker = _scenes.get(sid)
+        if tracker is not None:
+            _scenes.move_to_end(sid)
+            return tracker
+    names = [character["name"]]
+    if character.get("ip"):
+        names += [p.rsplit("/", 1)[-1] for p in get_characters_by_ip(character["ip"])]
+    with _scene_lock:
+        tracker = _scenes.setdefault(sid, SceneTracker(names))
+        while len(_scenes) > SCENE_CAP:
+            _scenes.popitem(last=False)
+    return tracker
+
+
+def _render_scene(character: dict, memory: MemoryManager, seq: int,
+                  on_image: Optional[Callable[[str], None]], scene_text: str = ""):
+    """
+    SD prompt from the chat's current memory, then hand the render to the SD
+    job queue. Runs on the memory worker; a render
+    is skipped when a newer turn has already been queued behind it, or when
+    the turn did not change anything visual.
+    """
+    sid = session_id(character)
+    tracker = scene_tracker(character)
+    tracker.observe(scene_text)        # even superseded turns count towards the scene
+    if seq != _scene_seq.get(sid):
+        return
+    if SCENE_GATE and not tracker.changed():
+        tracker.skip()
+        if tracker.image and on_image:   # same scene: this reply keeps the current picture
+            on_image(tracker.image)
+        return
+    from sd.prompt import generate_sd_prompt
+    from sd.sd_test import build_payload
+
+    try:
+        result = generate_sd_prompt(memory, ch=character, model_name=SD_PROMPT_MODEL,
+                                    llm_options=SD_PROMPT_OPTIONS, save=False)
+    except Exception as exc:  # the chat must survive a missing/broken Ollama
+        print(f"⚠️ SD prompt generation failed: {exc}")
+        return
+    if not result.get("prompt"):
+        return
+
+    payload = build_payload(result["prompt"])
+    key = cache_key(payload)
+    cached = image_cache.get(key)
+    if cached:                         # same prompt + settings: no SD call at all
+        sd_queue.cancel(sid)
+        tracker.commit(cached)
+        if on_image:
+            on_image(cached)
+        return
+
+    def _done(path: str):
+        image_cache.add(key)
+        tracker.commit(path)
+        if on_image:
+            on_image(path)
+
+    # rendering happens on the SD queue's workers; a newer turn of the same
+    # chat supersedes (and interrupts) this one
+    sd_queue.submit(sid, payload, image_cache.path_for(key), on_done=_done)
+
+
+def start_turn(
+    events: queue.Queue,
+    character: dict,
+    chain,
+    narr_chain,
+    raw_context: str | List[str],
+    user_input: str,
+    concurrent: bool | None = None,
+    tag=None
+) -> threading.Thread:
+    """
+    Run `run_turn` in a daemon thread and forward every event onto `events`.
+    The thread always finishes with ("finished", None), preceded by
+    ("error", exc) if the turn raised. The scene image arrives later as
+    ("image", (path, tag)); `tag` says which reply it belongs to.
+    Tk code drains `events` with `after`.
+    """
+    def _on_image(path: str):
+        events.put(("image", (path, tag)))
+
+    def _work():
+        try:
+            for ev in run_turn(character, chain, narr_chain, raw_context, user_input,
+                               concurrent, on_image=_on_image):
+                events.put(ev)
+        except Exception as exc:
+            events.put(("error", exc))
+        finally:
+            events.put(("finished", None))
+
+    t = threading.Thread(target=_work, daemon=True, name="chat-turn")
+    t.start()
+    return t
+
+
+def process_turn(
+    character: dict,
+    chain,
+    narr_chain,
+    raw_context: str | List[str],
+    user_input: str,
+    concurrent: bool | None = None
+) -> Tuple[List[str], List[str], str]:
+    """
+    Blocking wrapper around `run_turn`: returns (narr_tokens, char_tokens,
+    new_context) once the whole turn, including memory and SD, is done.
+    """
+    result: Tuple[List[str], List[str], str] = ([], [], raw_context)
+    for kind, payload in run_turn(character, chain, narr_chain, raw_context, user_input, concurrent):
+        if kind == "reply":
+            result = payload[:3]
+    session_memory(character).flush()
+    sd_queue.flush()
+    return result
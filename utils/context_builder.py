@@ -0,0 +1,159 @@
+import re
+from typing import Callable, Dict, List, Optional, Sequence, Tuple
+
+# ---------------------------------------------------------------------------
+#   Token-budgeted prompt context
+# ---------------------------------------------------------------------------
+# Fills a per-model token budget in priority order
+#     persona  →  memory summary  →  relevant facts  →  most recent turns
+# and reports how many tokens each section used. Older turns are the first
+# thing to go; the summary is what keeps them "remembered". They are dropped
+# in blocks of `trim_block` pieces, so the start of the dialogue – and with it
+# the model's cached prompt prefix – only moves every few turns.
+# ---------------------------------------------------------------------------
+
+# Context window (num_ctx) we run each model with. The chains pass the same
+# value to Ollama, so the budget matches what the model actually sees.
+MODEL_CONTEXT_WINDOWS = {
+    "llama3":   8192,
+    "llama3.2": 8192,
+}
+DEFAULT_CONTEXT_WINDOW = 4096
+
+# tokens kept free for the reply itself
+REPLY_RESERVE = 512
+
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af]")
+
+
+def context_window(model: str) -> int:
+    return MODEL_CONTEXT_WINDOWS.get(model, DEFAULT_CONTEXT_WINDOW)
+
+
+def approx_token_count(text: str) -> int:
+    """
+    Fast estimate without a tokenizer: ~4 characters per token for
+    alphabetic text, one token per CJK character (BPE vocabularies rarely
+    merge those). Slightly pessimistic, which is the safe side.
+    """
+    if not text:
+        return 0
+    cjk = len(_CJK_RE.findall(text))
+    return cjk + (len(text) - cjk + 3) // 4
+
+
+def make_token_counter(encoding: Optional[str] = "cl100k_base") -> Callable[[str], int]:
+    """
+    Exact counts via `tiktoken` when it is installed (cl100k_base is close
+    to the Llama 3 vocabulary), otherwise `approx_token_count`.
+    """
+    if encoding:
+        try:
+            import tiktoken
+            enc = tiktoken.get_encoding(encoding)
+            return lambda text: len(enc.encode(text, disallowed_special=()))
+        except Exception:  # not installed / offline – fall back
+            pass
+    return approx_token_count
+
+
+class ContextAssembler:
+    """
+    Builds the {context} string for the chains within the model's budget.
+    Every call returns its own per-section token report, so one assembler
+    can serve many chats at once.
+    """
+
+    def __init__(
+        self,
+        model: str = "llama3",
+        budget: Optional[int] = None,
+        reserve: int = REPLY_RESERVE,
+        count_tokens: Optional[Callable[[str], int]] = None,
+        trim_block: int = 8
+    ):
+        self.model = model
+        self.trim_block = max(trim_block, 1)
+        self.budget = budget if budget is not None else context_window(model) - reserve
+        self.count = count_tokens or make_token_counter()
+
+    def _clip(self, text: str, limit: int) -> str:
+        """Cut `text` to roughly `limit` tokens, keeping the start."""
+        if limit <= 0:
+            return ""
+        if self.count(text) <= limit:
+            return text
+        lo, hi = 0, len(text)
+        while lo < hi:                      # binary search on characters
+            mid = (lo + hi + 1) // 2
+            if self.count(text[:mid]) <= limit:
+                lo = mid
+            else:
+                hi = mid - 1
+        return text[:lo].rstrip() + "…"
+
+    def assemble(
+        self,
+        persona: str,
+        summary: str,
+        facts: Sequence[str],
+        turns: Sequence[str],
+        user_input: str = ""
+    ) -> Tuple[str, Dict[str, int]]:
+        """
+        Return (context, usage). `persona` and `user_input` are already part
+        of the prompt template – they are only counted, not emitted.
+        """
+        mem_block, history, usage = self.assemble_parts(persona, summary, facts, turns, user_input)
+        return mem_block + history, usage
+
+    def assemble_parts(
+        self,
+        persona: str,
+        summary: str,
+        facts: Sequence[str],
+        turns: Sequence[str],
+        user_input: str = ""
+    ) -> Tuple[str, str, Dict[str, int]]:
+        """
+        Like `assemble`, but return the memory block (summary + facts) and
+        the dialogue history separately: (memory, history, usage).
+        """
+        left = self.budget - self.count(persona) - self.count(user_input)
+        usage = {"budget": self.budget, "persona": self.budget - left}
+
+        summary = self._clip(summary or "(no summary yet)", left // 2)
+        sum_block = f"Memories summary:\n{summary}\n\n"
+        usage["summary"] = self.count(sum_block)
+        left -= usage["summary"]
+
+        kept_facts: List[str] = []
+        fact_tokens = self.count("Relevant facts:\n\n\n")
+        for fact in facts:
+            cost = self.count(fact) + 1
+            if fact_tokens + cost > left // 2:
+                break
+            kept_facts.append(fact)
+            fact_tokens += cost
+        facts_block = "Relevant facts:\n" + ("\n".join(kept_facts) or "(no relevant facts)") + "\n\n"
+        usage["facts"] = self.count(facts_block)
+        left -= usage["facts"]
+
+        fit, turn_tokens = 0, 0
+        costs = [self.count(t) + 1 for t in turns]
+        for cost in reversed(costs):        # newest first
+            if turn_tokens + cost > left:
+                break
+            fit += 1
+            turn_tokens += cost
+        drop = len(turns) - fit
+        if drop:                            # cut at a block boundary
+            drop = -(-drop // self.trim_block) * self.trim_block
+            turn_tokens = sum(costs[drop:])
+        kept_turns = list(turns[drop:])
+        usage["turns"] = turn_tokens
+        usage["turns_kept"] = len(kept_turns)
+        usage["turns_dropped"] = len(turns) - len(kept_turns)
+        usage["total"] = usage["persona"] + usage["summary"] + usage["facts"] + turn_tokens
+
+        return sum_block + facts_block, "\n\n".join(kept_turns), usage
@@ -0,0 +1,96 @@
+import hashlib
+import re
+from typing import List
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+#   Embedding providers for memory retrieval
+# ---------------------------------------------------------------------------
+# Every provider exposes the same two calls as LangChain's Embeddings, but
+# returns L2-normalised float32 NumPy arrays so a dot product is a cosine:
+#   embed_documents(texts) -> (len(texts), dim)
+#   embed_query(text)      -> (dim,)
+# ---------------------------------------------------------------------------
+
+_WORD_RE = re.compile(r"\w+", re.UNICODE)
+_CJK_RE = re.compile(r"[\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uac00-\ud7af]")
+
+
+def _normalise(mat: np.ndarray) -> np.ndarray:
+    norms = np.linalg.norm(mat, axis=-1, keepdims=True)
+    norms[norms == 0] = 1.0
+    return (mat / norms).astype(np.float32, copy=False)
+
+
+class HashingEmbedder:
+    """
+    Local, deterministic embedder (feature hashing). No model, no network –
+    the same text always maps to the same vector, which makes it the default
+    for offline runs and tests. Words plus character trigrams are hashed into
+    `dim` signed buckets; runs of CJK characters (no spaces between words)
+    are hashed as character unigrams and bigrams instead.
+    """
+
+    def __init__(self, dim: int = 256):
+        self.dim = dim
+
+    def _features(self, text: str) -> List[str]:
+        feats = []
+        for word in _WORD_RE.findall(text.lower()):
+            if _CJK_RE.search(word):
+                feats.extend(word)
+                feats.extend(word[i:i + 2] for i in range(len(word) - 1))
+                continue
+            feats.append(word)
+            if len(word) > 3:
+                feats.extend(word[i:i + 3] for i in range(len(word) - 2))
+        return feats
+
+    def _embed(self, text: str) -> np.ndarray:
+        vec = np.zeros(self.dim, dtype=np.float32)
+        for feat in self._features(text):
+            h = int.from_bytes(hashlib.blake2b(feat.encode("utf-8"), digest_size=8).digest(), "little")
+            vec[h % self.dim] += 1.0 if (h >> 63) & 1 else -1.0
+        return vec
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalise(np.stack([self._embed(t) for t in texts]))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return _normalise(self._embed(text))
+
+
+class OllamaEmbedder:
+    """
+    Semantic embeddings from an Ollama embedding model (e.g. nomic-embed-text).
+    """
+
+    def __init__(self, model: str = "nomic-embed-text"):
+        from langchain_ollama import OllamaEmbeddings
+
+        self._client = OllamaEmbeddings(model=model)
+        self.dim = len(self._client.embed_query("dimension probe"))
+
+    def embed_documents(self, texts: List[str]) -> np.ndarray:
+        if not texts:
+            return np.zeros((0, self.dim), dtype=np.float32)
+        return _normalise(np.asarray(self._client.embed_documents(texts), dtype=np.float32))
+
+    def embed_query(self, text: str) -> np.ndarray:
+        return _normalise(np.asarray(self._client.embed_query(text), dtype=np.float32))
+
+
+def make_embedder(spec: str = "hashing"):
+    """
+    Build a provider from a short spec: "hashing", "hashing:<dim>",
+    "ollama" or "ollama:<model>".
+    """
+    kind, _, arg = spec.partition(":")
+    if kind == "hashing":
+        return HashingEmbedder(int(arg)) if arg else HashingEmbedder()
+    if kind == "ollama":
+        return OllamaEmbedder(arg) if arg else OllamaEmbedder()
+    raise ValueError(f"Unknown embedder '{spec}'")
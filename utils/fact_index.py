@@ -0,0 +1,189 @@
+import heapq
+import math
+import re
+from collections import Counter
+from typing import Dict, List, Tuple
+
+import numpy as np
+
+# ---------------------------------------------------------------------------
+#   Retrieval indexes for MemoryManager facts
+# ---------------------------------------------------------------------------
+# Indexes only know integer fact ids; MemoryManager owns the fact dicts and
+# maps ids back to them. Every index supports add / remove / search.
+# ---------------------------------------------------------------------------
+
+
+class VectorIndex:
+    """
+    Dense cosine index over unit-length float32 vectors.
+
+    Rows live in one contiguous (capacity, dim) matrix that doubles when full,
+    so a query is a single mat-vec plus an `argpartition` top-k – no Python
+    loop over facts. Removal swaps the last row into the hole (O(dim)).
+    """
+
+    def __init__(self, dim: int, capacity: int = 1024):
+        self.dim = dim
+        self._mat = np.zeros((capacity, dim), dtype=np.float32)
+        self._ids = np.zeros(capacity, dtype=np.int64)
+        self._row: Dict[int, int] = {}
+        self._n = 0
+
+    def __len__(self) -> int:
+        return self._n
+
+    def __contains__(self, fid: int) -> bool:
+        return fid in self._row
+
+    def _grow(self, need: int):
+        cap = len(self._mat)
+        if need <= cap:
+            return
+        while cap < need:
+            cap *= 2
+        mat = np.zeros((cap, self.dim), dtype=np.float32)
+        mat[:self._n] = self._mat[:self._n]
+        ids = np.zeros(cap, dtype=np.int64)
+        ids[:self._n] = self._ids[:self._n]
+        self._mat, self._ids = mat, ids
+
+    def add(self, fid: int, vec: np.ndarray):
+        """Insert or overwrite the vector for `fid`."""
+        row = self._row.get(fid)
+        if row is None:
+            self._grow(self._n + 1)
+            row = self._n
+            self._n += 1
+            self._row[fid] = row
+            self._ids[row] = fid
+        self._mat[row] = vec
+
+    def add_many(self, fids: List[int], mat: np.ndarray):
+        """Insert or overwrite several vectors: one grow, one block copy."""
+        if not len(fids):
+            return
+        new = [fid for fid in dict.fromkeys(fids) if fid not in self._row]
+        self._grow(self._n + len(new))
+        for fid in new:
+            self._row[fid] = self._n
+            self._ids[self._n] = fid
+            self._n += 1
+        self._mat[[self._row[fid] for fid in fids]] = mat
+
+    def remove(self, fid: int):
+        row = self._row.pop(fid, None)
+        if row is None:
+            return
+        last = self._n - 1
+        if row != last:
+            moved = int(self._ids[last])
+            self._mat[row] = self._mat[last]
+            self._ids[row] = moved
+            self._row[moved] = row
+        self._n = last
+
+    def search(self, query: np.ndarray, top_k: int = 5, min_score: float = 0.0) -> List[Tuple[int, float]]:
+        """
+        Return up to `top_k` (fact id, cosine) pairs, best first, whose score
+        is strictly above `min_score`.
+        """
+        n = self._n
+        if n == 0 or top_k <= 0:
+            return []
+        scores = self._mat[:n] @ query
+        if n > top_k:
+            top = np.argpartition(scores, n - top_k)[n - top_k:]
+        else:
+            top = np.arange(n)
+        top = top[np.argsort(scores[top])[::-1]]
+        return [(int(self._ids[i]), float(scores[i])) for i in top if scores[i] > min_score]
+
+
+# ── BM25 inverted index ──────────────────────────────────────────────────────
+# Kana, CJK ideographs and Hangul: written without spaces, so word splitting
+# does not work and overlapping character bigrams are used as terms instead.
+_CJK = r"\u3040-\u30ff\u3400-\u4dbf\u4e00-\u9fff\uf900-\ufaff\uac00-\ud7af"
+_TOKEN_RE = re.compile(rf"([{_CJK}]+)|([^\W{_CJK}]+)", re.UNICODE)
+
+
+def tokenize(text: str) -> List[str]:
+    """
+    Lower-cased word tokens for alphabetic scripts, character bigrams for
+    CJK runs (a lone CJK character is kept as a unigram).
+      "Asuka 喜歡布丁!" -> ["asuka", "喜歡", "歡布", "布丁"]
+    """
+    tokens: List[str] = []
+    for cjk, word in _TOKEN_RE.findall(text.lower()):
+        if word:
+            tokens.append(word)
+        elif len(cjk) == 1:
+            tokens.append(cjk)
+        else:
+            tokens.extend(cjk[i:i + 2] for i in range(len(cjk) - 1))
+    return tokens
+
+
+class BM25Index:
+    """
+    Incrementally maintained inverted index with Okapi BM25 ranking.
+
+    add/remove touch only the document's own terms; a query walks only the
+    postings of its terms, never the whole collection.
+    """
+
+    def __init__(self, k1: float = 1.5, b: float = 0.75, tokenizer=tokenize):
+        self.k1, self.b = k1, b
+        self.tokenizer = tokenizer
+        self._postings: Dict[str, Dict[int, int]] = {}
+        self._doc_terms: Dict[int, Counter] = {}
+        self._doc_len: Dict[int, int] = {}
+        self._total_len = 0
+
+    def __len__(self) -> int:
+        return len(self._doc_len)
+
+    def __contains__(self, fid: int) -> bool:
+        return fid in self._doc_len
+
+    def add(self, fid: int, text: str):
+        """Insert or re-index the document `fid`."""
+        if fid in self._doc_len:
+            self.remove(fid)
+        terms = Counter(self.tokenizer(text))
+        for term, tf in terms.items():
+            self._postings.setdefault(term, {})[fid] = tf
+        self._doc_terms[fid] = terms
+        length = sum(terms.values())
+        self._doc_len[fid] = length
+        self._total_len += length
+
+    def remove(self, fid: int):
+        terms = self._doc_terms.pop(fid, None)
+        if terms is None:
+            return
+        for term in terms:
+            plist = self._postings[term]
+            del plist[fid]
+            if not plist:
+                del self._postings[term]
+        self._total_len -= self._doc_len.pop(fid)
+
+    def search(self, query: str, top_k: int = 5) -> List[Tuple[int, float]]:
+        """Return up to `top_k` (doc id, BM25 score) pairs, best first."""
+        n = len(self._doc_len)
+        if n == 0 or top_k <= 0:
+            return []
+        avgdl = self._total_len / n or 1.0
+        k1, b = self.k1, self.b
+        scores: Dict[int, float] = {}
+        for term in set(self.tokenizer(query)):
+            plist = self._postings.get(term)
+            if not plist:
+                continue
+            df = len(plist)
+            idf = math.log(1.0 + (n - df + 0.5) / (df + 0.5))
+            for fid, tf in plist.items():
+                norm = tf + k1 * (1.0 - b + b * self._doc_len[fid] / avgdl)
+                scores[fid] = scores.get(fid, 0.0) + idf * tf * (k1 + 1.0) / norm
+        return heapq.nlargest(top_k, scores.items(), key=lambda kv: kv[1])
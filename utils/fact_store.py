@@ -0,0 +1,205 @@
+import math
+import re
+import unicodedata
+from typing import Callable, Dict, Iterable, List, Optional, Tuple
+
+from utils.fact_index import tokenize
+
+# ---------------------------------------------------------------------------
+#   Bounded, de-duplicated fact store
+# ---------------------------------------------------------------------------
+# Owns the fact dicts of a MemoryManager. New facts are normalised and merged
+# into an existing entry when they are (near-)identical, the store is kept
+# under `capacity` by evicting the least valuable facts, and every
+# `consolidate_every` inserts related facts of the same type are merged.
+# Each fact dict carries its bookkeeping next to "type"/"text":
+#   {"id": 7, "type": "fact", "text": "…", "hits": 3, "turn": 42}
+# ---------------------------------------------------------------------------
+
+# type → weight in the eviction score (unknown types use the default)
+TYPE_WEIGHTS = {"fact": 1.0, "feeling": 0.7}
+_DEFAULT_WEIGHT = 0.85
+
+_PUNCT_RE = re.compile(r"[^\w\s]", re.UNICODE)
+_SPACE_RE = re.compile(r"\s+")
+
+
+def normalise(text: str) -> str:
+    """NFKC, lower-case, no punctuation, single spaces."""
+    text = unicodedata.normalize("NFKC", text).lower()
+    return _SPACE_RE.sub(" ", _PUNCT_RE.sub(" ", text)).strip()
+
+
+def _jaccard(a: frozenset, b: frozenset) -> float:
+    if not a or not b:
+        return 0.0
+    return len(a & b) / len(a | b)
+
+
+class FactStore:
+    """
+    Insertion-ordered fact collection with de-duplication and eviction.
+
+    `on_remove(fid)` is called for every fact that leaves the store (evicted,
+    merged away or deleted) so the owner can drop it from its indexes.
+    """
+
+    def __init__(
+        self,
+        capacity: int = 2000,
+        dup_threshold: float = 0.9,
+        merge_threshold: float = 0.75,
+        consolidate_every: int = 50,
+        half_life: float = 200.0,
+        on_remove: Optional[Callable[[int], None]] = None
+    ):
+        self.capacity = capacity
+        self.dup_threshold = dup_threshold
+        self.merge_threshold = merge_threshold
+        self.consolidate_every = consolidate_every
+        self.half_life = half_life
+        self.on_remove = on_remove
+
+        self._facts: Dict[int, Dict] = {}
+        self._by_key: Dict[Tuple[str, str], int] = {}
+        self._sig: Dict[int, frozenset] = {}
+        self._next_id = 0
+        self._since_consolidate = 0
+        self.stats = {"inserted": 0, "duplicates": 0, "evicted": 0, "merged": 0, "deleted": 0}
+
+    # ── container protocol ─────────────────────────────────────────────────
+    def __len__(self) -> int:
+        return len(self._facts)
+
+    def __contains__(self, fid: int) -> bool:
+        return fid in self._facts
+
+    def get(self, fid: int) -> Optional[Dict]:
+        return self._facts.get(fid)
+
+    def facts(self) -> List[Dict]:
+        """All facts, oldest first."""
+        return list(self._facts.values())
+
+    def clear(self):
+        """Drop every fact and reset the counters (no on_remove calls)."""
+        self._facts.clear()
+        self._by_key.clear()
+        self._sig.clear()
+        self._next_id = 0
+        self._since_consolidate = 0
+        self.stats = dict.fromkeys(self.stats, 0)
+
+    # ── writes ─────────────────────────────────────────────────────────────
+    def add(self, ftype: str, text: str, turn: int, candidates: Iterable[int] = ()) -> Tuple[Dict, bool]:
+        """
+        Store one fact. Returns (fact, is_new); when an exact or near-identical
+        fact of the same type exists (looked up by normalised text, then among
+        `candidates` by token overlap) that fact is refreshed instead.
+        """
+        key = (ftype, normalise(text))
+        sig = frozenset(tokenize(key[1]))
+        fid = self._by_key.get(key)
+        if fid is None:
+            for cid in candidates:
+                other = self._facts.get(cid)
+                if (other is not None and other["type"] == ftype
+                        and _jaccard(sig, self._sig[cid]) >= self.dup_threshold):
+                    fid = cid
+                    break
+        if fid is not None:
+            fact = self._facts[fid]
+            fact["hits"] += 1
+            fact["turn"] = turn
+            self.stats["duplicates"] += 1
+            return fact, False
+
+        fid = self._next_id
+        self._next_id += 1
+        fact = {"id": fid, "type": ftype, "text": text, "hits": 0, "turn": turn}
+        self._facts[fid] = fact
+        self._by_key[key] = fid
+        self._sig[fid] = sig
+        self.stats["inserted"] += 1
+        self._since_consolidate += 1
+        return fact, True
+
+    def restore(self, fact: Dict):
+        """Re-insert a previously stored fact as-is (ids are kept)."""
+        fid = fact["id"]
+        self._facts[fid] = fact
+        self._by_key[(fact["type"], normalise(fact["text"]))] = fid
+        self._sig[fid] = frozenset(tokenize(normalise(fact["text"])))
+        self._next_id = max(self._next_id, fid + 1)
+
+    def touch(self, fids: Iterable[int], turn: int):
+        """Record that these facts were retrieved into a prompt."""
+        for fid in fids:
+            fact = self._facts.get(fid)
+            if fact is not None:
+                fact["hits"] += 1
+                fact["turn"] = turn
+
+    def remove(self, fid: int, reason: str = "deleted") -> bool:
+        fact = self._facts.pop(fid, None)
+        if fact is None:
+            return False
+        key = (fact["type"], normalise(fact["text"]))
+        if self._by_key.get(key) == fid:
+            del self._by_key[key]
+        del self._sig[fid]
+        self.stats[reason] += 1
+        if self.on_remove:
+            self.on_remove(fid)
+        return True
+
+    # ── maintenance ────────────────────────────────────────────────────────
+    def score(self, fact: Dict, turn: int) -> float:
+        """Higher is more worth keeping: type weight × hit bonus × recency."""
+        weight = TYPE_WEIGHTS.get(fact["type"], _DEFAULT_WEIGHT)
+        recency = 0.5 ** (max(turn - fact["turn"], 0) / self.half_life)
+        return weight * (1.0 + math.log1p(fact["hits"])) * recency
+
+    def evict(self, turn: int) -> List[int]:
+        """
+        If over capacity, drop the lowest-scoring facts down to 90 % of it,
+        so the O(n) scoring pass runs once per batch, not on every insert.
+        """
+        if len(self._facts) <= self.capacity:
+            return []
+        target = int(self.capacity * 0.9)
+        ranked = sorted(self._facts.values(), key=lambda f: self.score(f, turn))
+        victims = [f["id"] for f in ranked[:len(self._facts) - target]]
+        for fid in victims:
+            self.remove(fid, reason="evicted")
+        return victims
+
+    def due_for_consolidation(self) -> bool:
+        return self._since_consolidate >= self.consolidate_every
+
+    def consolidate(self, find_candidates: Callable[[Dict], Iterable[int]]) -> int:
+        """
+        Merge related facts of the same type (token overlap ≥ merge_threshold).
+        The survivor is the more-hit (then newer) fact; it inherits the other's
+        hits. Returns how many facts were merged away.
+        """
+        self._since_consolidate = 0
+        merged = 0
+        for fid in list(self._facts):
+            fact = self._facts.get(fid)
+            if fact is None:
+                continue
+            for cid in find_candidates(fact):
+                other = self._facts.get(cid)
+                if (cid == fid or other is None or other["type"] != fact["type"]
+                        or _jaccard(self._sig[fid], self._sig[cid]) < self.merge_threshold):
+                    continue
+                keep, drop = sorted((fact, other), key=lambda f: (f["hits"], f["turn"]), reverse=True)
+                keep["hits"] += drop["hits"]
+                keep["turn"] = max(keep["turn"], drop["turn"])
+                self.remove(drop["id"], reason="merged")
+                merged += 1
+                if drop is fact:
+                    break
+                fact = keep
+        return merged
@@ -1,13 +1,17 @@
 import json
 import os
+import queue
 import sys
 import tkinter as tk
 from tkinter import ttk
-from PIL import Image, ImageTk
 
-from utils.chat_logic    import build_character_chain, build_narrator_chain, process_turn, memory
+from utils.chat_logic    import build_character_chain, build_narrator_chain, start_turn, open_memory, session_memory, memory_registry
 from utils.user_data     import update_user_tags
 from utils.gui_helper    import center_window
+from utils.llm_registry  import registry_stats
+from sd.job_queue        import sd_queue
+from utils.transcript    import Transcript
+from utils.image_presenter import ImagePresenter
 
 # ──────────── helper text editor ────────────
 def big_text_dialog(parent, title, initial=""):
@@ -28,7 +32,10 @@ def big_text_dialog(parent, title, initial=""):
     return out["val"]
 
 # ──────────── debug: show memory ────────────
-def show_memory_debug(root):
+def show_memory_debug(root, character, stats=None):
+    # stats: the "reply" stats of the chat's latest turn (see chat_logic.run_turn)
+    stats = stats or {}
+    memory = session_memory(character)
     win = tk.Toplevel(root)
     win.title("Memory Debug")
     win.geometry("800x600")
@@ -38,16 +45,53 @@ def show_memory_debug(root):
     s = tk.Text(win, height=5, wrap="word"); s.pack(fill="x", padx=10)
     s.insert("1.0", memory.summary or "(empty)"); s.config(state="disabled")
 
+    st = memory.memory_stats()
     ttk.Label(win, text="Facts:", font=("Arial",12,"bold")).pack(anchor="w", padx=10, pady=(10,0))
+    ttk.Label(win, text=(f"{st['size']} / {st['capacity']} stored · {st['inserted']} inserted · "
+                         f"{st['duplicates']} duplicates · {st['evicted']} evicted · "
+                         f"{st['merged']} merged · {st['deleted']} deleted"),
+              foreground="gray").pack(anchor="w", padx=10)
     f = tk.Text(win, height=10, wrap="word"); f.pack(fill="both", expand=True, padx=10, pady=(0,10))
     f.insert("1.0", json.dumps(memory.fact_memory, indent=2, ensure_ascii=False))
     f.config(state="disabled")
 
+    u = stats.get("usage")
+    if u:
+        ttk.Label(win, text=(f"Last prompt: {u['total']} / {u['budget']} tokens · persona {u['persona']} · "
+                             f"summary {u['summary']} · facts {u['facts']} · turns {u['turns']} "
+                             f"({u['turns_kept']} kept, {u['turns_dropped']} dropped)"),
+                  foreground="gray").pack(anchor="w", padx=10, pady=(0,10))
+
+    t = stats
+    if "char_ttft" in t:
+        ttft = f"narrator {t.get('narr_ttft', 0):.2f}s · character {t['char_ttft']:.2f}s"
+        ttk.Label(win, text=f"Time to first token ({t['layout']} layout): {ttft}",
+                  foreground="gray").pack(anchor="w", padx=10, pady=(0,10))
+
+    r = registry_stats()
+    ttk.Label(win, text=(f"LLM clients: {r['clients']} · {r['in_flight']} in flight · "
+                         f"{r['requests']} requests · {r['open_connections']} open connections"),
+              foreground="gray").pack(anchor="w", padx=10, pady=(0,10))
+
+    m = memory_registry.session_stats()
+    ttk.Label(win, text=(f"Chat memories: {m['resident']} resident · {m['opened']} opened · "
+                         f"{m['hibernated']} hibernated"),
+              foreground="gray").pack(anchor="w", padx=10, pady=(0,10))
+
+    q = sd_queue.queue_stats()
+    ttk.Label(win, text=(f"SD queue: {q['workers']} workers · {q['pending']} waiting · {q['running']} rendering · "
+                         f"{q['completed']} done · {q['superseded']} superseded · {q['interrupted']} interrupted · "
+                         f"{q['failed']} failed"),
+              foreground="gray").pack(anchor="w", padx=10, pady=(0,10))
+
 # ──────────── message widgets ────────────
+# Views over one Transcript turn each: every change goes through the
+# transcript first, the labels just show the turn's current state.
 class UserBox(ttk.Frame):
-    def __init__(self, parent, text, on_edit, on_del):
+    def __init__(self, parent, transcript, turn, on_edit, on_del):
         super().__init__(parent)
-        self.msg = tk.StringVar(value=text)
+        self.transcript, self.turn = transcript, turn
+        self.msg = tk.StringVar(value=turn.text)
         ttk.Label(self, text="You:", style="User.TLabel").pack(anchor="w")
         ttk.Label(self, textvariable=self.msg, wraplength=900, style="User.TLabel")\
             .pack(anchor="w", padx=5)
@@ -57,12 +101,15 @@ class UserBox(ttk.Frame):
     def _edit(self, cb):
         new = big_text_dialog(self, "Edit message", self.msg.get())
         if new is not None:
-            old = self.msg.get(); self.msg.set(new); cb(self, old, new)
+            old = self.msg.get()
+            self.transcript.edit(self.turn.id, new); self.msg.set(new)
+            cb(self, old, new)
 
 class ReplyBox(ttk.Frame):
-    def __init__(self, parent, char_name, on_regen, on_edit, on_del):
+    def __init__(self, parent, transcript, turn, char_name, on_regen, on_edit, on_del, show_image=None):
         super().__init__(parent)
-        self.vers, self.idx = [], -1
+        self.transcript, self.turn = transcript, turn
+        self.show_image = show_image
         self.narr_lbl = ttk.Label(self, style="Narr.TLabel", wraplength=900, justify="left")
         self.char_hdr = ttk.Label(self, text=f"{char_name}:", style="CharHdr.TLabel")
         self.reply_lbl= ttk.Label(self, style="Char.TLabel", wraplength=900, justify="left")
@@ -76,28 +123,39 @@ class ReplyBox(ttk.Frame):
         ttk.Button(bar, text="Delete", width=6, command=lambda: on_del(self)).pack(side="left")
         self.prev_b.pack(side="left"); self.next_b.pack(side="left")
 
+    @property
+    def vers(self): return self.turn.versions
+
+    @property
+    def idx(self):  return self.turn.idx
+
     def start_new_version(self):
-        self.vers.append({"narr":"*", "reply":""})
-        self.idx = len(self.vers)-1
+        self.transcript.new_version(self.turn.id)
         self._render()
 
     def append_narr(self, tok):
-        self.vers[self.idx]["narr"] += tok
+        self.transcript.append_text(self.turn.id, "narr", tok)
         self.narr_lbl.config(text=self.vers[self.idx]["narr"])
 
     def end_narr(self):
-        self.vers[self.idx]["narr"] += "*"
-        self.narr_lbl.config(text=self.vers[self.idx]["narr"])
+        self.append_narr("*")
 
     def append_reply(self, tok):
-        self.vers[self.idx]["reply"] += tok
+        self.transcript.append_text(self.turn.id, "reply", tok)
         self.reply_lbl.config(text=self.vers[self.idx]["reply"])
 
+    def set_reply(self, text):
+        self.transcript.edit(self.turn.id, text)
+        self._render()
+
     def _flip(self, step):
         new = self.idx + step
         if 0 <= new < len(self.vers):
-            self.idx = new
+            self.transcript.set_version(self.turn.id, new)
             self._render()
+            image = self.vers[self.idx].get("image")
+            if image and self.show_image:   # cached file, shown straight away
+                self.show_image(image)
 
     def _render(self):
         narr = self.vers[self.idx]["narr"]
@@ -121,14 +179,14 @@ def open_chatroom(root, app_gui, character, user_data):
     sty.configure("CharHdr.TLabel", font=("Arial",12,"bold"))
     sty.configure("Char.TLabel",    font=("Arial",12))
 
-    # build LLM chains + initial context
+    # restore this character's memory, build LLM chains + initial context
+    open_memory(user_data["username"], character)
     chain      = build_character_chain(character)
     narr_chain = build_narrator_chain(character)
     raw        = character.get("greeting","")
     lines      = raw.splitlines()
-    hidden     = "\n".join([ln for ln in lines if ln.strip().startswith("*")])
     visible    = "\n".join([ln for ln in lines if not ln.strip().startswith("*")]).strip()
-    context    = "\n\n".join(filter(None,[hidden,visible]))
+    transcript = Transcript(character["name"], raw)   # the chat; widgets are views
 
     # constants
     COL_W   = root.winfo_screenwidth() // 2
@@ -152,10 +210,7 @@ def open_chatroom(root, app_gui, character, user_data):
     img_label.image = None
 
     def set_sd_image(path):
-        img = Image.open(path).resize((COL_W, IMG_H), Image.LANCZOS)
-        photo = ImageTk.PhotoImage(img)
-        img_label.config(image=photo)
-        img_label.image = photo
+        presenter.show(path)   # decoded off the Tk thread, see pump_events
 
     # ── Row 1: dialogue frame ────────────────────────────────────────────
     dialog = ttk.Frame(root, style="Dialog.TFrame")
@@ -196,37 +251,26 @@ def open_chatroom(root, app_gui, character, user_data):
         dialog.update_idletasks()
         canvas.yview_moveto(1.0)
 
-    # context management
-    def rebuild_context():
-        nonlocal context
-        pieces = [raw]
-        for child in feed.winfo_children():
-            if isinstance(child, UserBox):
-                pieces.append(f"User: {child.msg.get()}")
-            elif isinstance(child, ReplyBox):
-                cur = child.vers[child.idx]
-                pieces.append(f"{character['name']}: {cur['reply']}")
-        context = "\n\n".join(pieces[-300:])
+    # context management: delete a turn and everything after it
+    boxes = []   # message widgets, same order as their transcript turns
 
     def cascade_delete(box):
-        idx = feed.winfo_children().index(box)
-        for c in feed.winfo_children()[idx:][::-1]:
+        transcript.truncate(box.turn.id)
+        idx = boxes.index(box)
+        for c in boxes[idx:][::-1]:
             c.destroy()
-        rebuild_context()
+        del boxes[idx:]
 
     # adding boxes
     active_reply = {"box": None}
-    last_user    = None
 
     def add_user_box(txt):
-        def _edit(b, old, new):
-            nonlocal context
-            context = context.replace(old,new)
-            rebuild_context()
+        def _edit(b, old, new): pass   # the transcript is already updated
         def _del(b): cascade_delete(b)
 
-        b = UserBox(feed, txt, _edit, _del)
+        b = UserBox(feed, transcript, transcript.add_user(txt), _edit, _del)
         b.pack(anchor="w", fill="x", padx=5, pady=4)
+        boxes.append(b)
         scroll_bot()
         return b
 
@@ -235,67 +279,107 @@ def open_chatroom(root, app_gui, character, user_data):
             cur = b.vers[b.idx]["reply"]
             new = big_text_dialog(root, "Edit reply", cur)
             if new:
-                b.vers[b.idx]["reply"] = new
-                b._render()
-                rebuild_context()
+                b.set_reply(new)
         def _del(b): cascade_delete(b)
 
-        rb = ReplyBox(feed, character["name"], regen, _edit, _del)
+        rb = ReplyBox(feed, transcript, transcript.add_reply(), character["name"], regen, _edit, _del,
+                      show_image=set_sd_image)
+        boxes.append(rb)
         rb.pack(anchor="e", fill="x", padx=5, pady=4)
         active_reply["box"] = rb
         return rb
 
+    # streaming turns: a worker thread fills `events`, the Tk loop drains it
+    events = queue.Queue()
+    turn   = {"box": None, "narr": True, "user_turn": False, "busy": False, "stats": None}
+    presenter = ImagePresenter(img_label, (COL_W, IMG_H), events)
+
+    def begin_turn(box, user_text, context, show_narr=True, user_turn=False):
+        # `context` is the history before this turn; the prompt adds user_text itself
+        turn.update(box=box, narr=show_narr, user_turn=user_turn, busy=True)
+        start_turn(events, character, chain, narr_chain, context, user_text,
+                   tag=(box.turn.id, box.idx))
+
+    def pump_events():
+        if not feed.winfo_exists():   # chatroom closed – stop polling
+            presenter.close()
+            return
+        box, got = turn["box"], False
+        alive = box is not None and box.winfo_exists()
+        while True:
+            try:
+                kind, payload = events.get_nowait()
+            except queue.Empty:
+                break
+            got = True
+            if kind == "narr" and turn["narr"] and alive:
+                box.append_narr(payload)
+            elif kind == "narr_end" and turn["narr"] and alive:
+                box.end_narr()
+            elif kind == "char" and alive:
+                box.append_reply(payload)
+            elif kind == "reply":
+                turn["stats"] = payload[3]   # this turn's TTFT + token report
+                if turn["user_turn"]:
+                    update_user_tags(user_data, character)
+            elif kind == "image":
+                path, tag = payload
+                if tag is None:
+                    set_sd_image(path)
+                elif transcript.attach_image(*tag, path):
+                    tid, idx = tag
+                    if transcript.get(tid).idx == idx:   # that version is on screen
+                        set_sd_image(path)
+            elif kind == "image_ready":
+                presenter.deliver(payload)
+            elif kind == "error":
+                print(f"⚠️ Turn failed: {payload}")
+            elif kind == "finished":
+                turn["busy"] = False
+        if got:
+            scroll_bot()
+        root.after(30, pump_events)
+
     # continue / regenerate
     def continue_reply():
         rb = active_reply.get("box")
         if not rb or not rb.winfo_exists(): return
-        narr_toks, char_toks, new_ctx = process_turn(character, chain, narr_chain, context, "")
-        for tok in char_toks: rb.append_reply(tok); scroll_bot()
-        rebuild_context()
+        begin_turn(rb, "", transcript.pieces(), show_narr=False)   # history ends with the reply to extend
 
     def regenerate_after_delete():
         rb = add_reply_box(); rb.start_new_version()
-        narr_toks, char_toks, new_ctx = process_turn(character, chain, narr_chain, context, "")
-        for tok in narr_toks: rb.append_narr(tok); scroll_bot()
-        rb.end_narr(); scroll_bot()
-        for tok in char_toks: rb.append_reply(tok); scroll_bot()
-        rebuild_context()
+        begin_turn(rb, "", transcript.pieces(before=rb.turn.id))
 
     def regen(box):
-        last  = last_user.msg.get() if last_user else ""
+        if turn["busy"]: return
+        last_user = transcript.last("user", before=box.turn.id)
+        last  = last_user.text if last_user else ""
         extra = big_text_dialog(root, "Regenerate instructions", "") or ""
         inp_text = last + (f"\n\n{extra}" if extra else "")
         box.start_new_version()
-        narr_toks, char_toks, new_ctx = process_turn(character, chain, narr_chain, context, inp_text)
-        for tok in narr_toks: box.append_narr(tok); scroll_bot()
-        box.end_narr(); scroll_bot()
-        for tok in char_toks: box.append_reply(tok); scroll_bot()
-        rebuild_context()
+        # the user message is the input, so the history stops before it
+        begin_turn(box, inp_text, transcript.pieces(before=(last_user or box.turn).id))
 
     # ─── Send / key binding ───
     def send(event=None):
-        nonlocal last_user
+        if turn["busy"]: return "break"
         q = inp.get("1.0","end").strip()
         if not q:
             rb = active_reply.get("box")
             if rb and rb.winfo_exists(): continue_reply()
-            elif last_user: regenerate_after_delete()
+            elif transcript.last("user"): regenerate_after_delete()
             return "break"
 
         inp.delete("1.0","end"); _grow()
-        last_user = add_user_box(q)
+        ub        = add_user_box(q)
         rb        = add_reply_box(); rb.start_new_version()
-        narr_toks, char_toks, new_ctx = process_turn(character, chain, narr_chain, context, q)
-        for tok in narr_toks: rb.append_narr(tok); scroll_bot()
-        rb.end_narr(); scroll_bot()
-        for tok in char_toks: rb.append_reply(tok); scroll_bot()
-        rebuild_context()
-        update_user_tags(user_data, character)
-        set_sd_image(f"{character['name']}_turn.png")
+        begin_turn(rb, q, transcript.pieces(before=ub.turn.id), user_turn=True)
         return "break"
 
     inp.bind("<Return>", send)
+    inp.bind("<F12>", lambda e: show_memory_debug(root, character, turn["stats"]))
     root.bind_all("<Escape>", lambda e:(root.unbind_all("<Escape>"), app_gui.go_back()), add="+")
 
     center_window(root)
     scroll_bot()
+    pump_events()
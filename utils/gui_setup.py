@@ -1,5 +1,4 @@
 import os
-import json
 import tkinter as tk
 from tkinter import ttk
 
@@ -12,7 +11,7 @@ from utils.character_creation import open_create_character_window
 from utils.gui_chatroom import open_chatroom
 from utils.gui_helper import center_window
 from utils.recommender import recommend_characters
-from utils.story_card_loader import gather_story_cards
+from utils.story_card_loader import gather_story_cards, story_card_snippets
 # ───────────────────────── home‑screen class ───────────────────────────────
 class ApplicationGUI:
     """Main selector / homepage for the chatbot GUI."""
@@ -203,23 +202,15 @@ class ApplicationGUI:
     def enter_chat(self, ip: str, path: str):
         """Load the chosen character, gather story‑cards, then open chat‑room."""
         character = load_character(ip, path)
+        character["ip"] = ip  # folder name, used to look up the IP's other characters
 
         # Pull in any user‑selected or auto‑extras ------------------------
         cards = gather_story_cards(ip, self.root)
         if cards:
-            snippets: list[str] = []
-            for c in cards:
-                entry = (
-                    c.get("entry")
-                    or c.get("description")
-                    or json.dumps(c, ensure_ascii=False)
-                )
-                tag = c.get("name") or c.get("type", "Info")
-                snippets.append(f"*{tag}*: {entry}")
-
+            # cards go into the static part of the prompt (see chat_logic
+            # PROMPT_LAYOUT), not the greeting, so they stay cache-friendly
             character = character.copy()  # don’t mutate shared cache
-            greeting = character.get("greeting", "")
-            character["greeting"] = "\n\n".join(snippets + [greeting])
+            character["story_cards"] = story_card_snippets(cards)
 
         # push onto history & open chat
         self.context_stack.append((ip, path))
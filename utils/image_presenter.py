@@ -0,0 +1,88 @@
+import queue
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+from typing import Tuple
+
+from PIL import Image, ImageTk
+
+# ---------------------------------------------------------------------------
+#   Scene image display path
+# ---------------------------------------------------------------------------
+# Decoding a 1152×768 hires.fix PNG and LANCZOS-resizing it on the Tk thread
+# stalls the chat. The presenter decodes and downsizes on a worker thread
+# (`draft` for JPEG, integer `reduce` first, then a short LANCZOS pass) and
+# hands the finished PIL image back through the chatroom's events queue, so
+# the Tk side only wraps it in a PhotoImage and swaps the label – once, from
+# the existing `after` poll. Ready PhotoImages are kept in a small LRU keyed
+# by file, so flipping between reply versions is instant.
+# ---------------------------------------------------------------------------
+
+
+def fit_image(path: str, size: Tuple[int, int]) -> Image.Image:
+    """Open `path` and scale it to exactly `size` as cheaply as possible."""
+    img = Image.open(path)
+    img.draft("RGB", size)                 # JPEG: decode at reduced scale
+    factor = min(img.width // size[0], img.height // size[1])
+    if factor >= 2:
+        img = img.reduce(factor)           # box-filter shrink, much faster than LANCZOS
+    if img.size != size:
+        img = img.resize(size, Image.LANCZOS)
+    img.load()
+    return img
+
+
+class ImagePresenter:
+    """
+    Shows scene images in one Tk label.
+
+    `show(path)` may be called for every image event; only the most recent
+    request ends up on screen. `deliver(payload)` must be called on the Tk
+    thread for every ("image_ready", payload) event taken off `events`.
+    """
+
+    def __init__(self, label, size: Tuple[int, int], events: queue.Queue, capacity: int = 8):
+        self.label = label
+        self.size = size
+        self.events = events
+        self.capacity = capacity
+        self._photos: "OrderedDict[str, ImageTk.PhotoImage]" = OrderedDict()
+        self._pool = ThreadPoolExecutor(max_workers=1, thread_name_prefix="image-decode")
+        self._wanted = None                    # path that should be on screen
+
+    def show(self, path: str):
+        """Tk thread: display `path`, from the LRU at once or after decoding."""
+        self._wanted = path
+        photo = self._photos.get(path)
+        if photo is not None:
+            self._photos.move_to_end(path)
+            self._swap(photo)
+            return
+        self._pool.submit(self._decode, path)
+
+    def _decode(self, path: str):
+        if path != self._wanted:               # superseded before we started
+            return
+        try:
+            img = fit_image(path, self.size)
+        except Exception as exc:  # half-written / deleted file – keep the old image
+            print(f"⚠️ Could not load scene image {path}: {exc}")
+            return
+        self.events.put(("image_ready", (path, img)))
+
+    def deliver(self, payload):
+        """Tk thread: wrap a decoded image, cache it, show it if still wanted."""
+        path, img = payload
+        photo = ImageTk.PhotoImage(img)
+        self._photos[path] = photo
+        self._photos.move_to_end(path)
+        while len(self._photos) > self.capacity:
+            self._photos.popitem(last=False)
+        if path == self._wanted:
+            self._swap(photo)
+
+    def _swap(self, photo):
+        self.label.config(image=photo)
+        self.label.image = photo               # keep a reference for Tk
+
+    def close(self):
+        self._pool.shutdown(wait=False, cancel_futures=True)
@@ -0,0 +1,156 @@
+import asyncio
+import os
+import threading
+import weakref
+from typing import Any, Dict, Tuple
+
+import httpx
+from langchain_ollama import OllamaLLM
+from pydantic import PrivateAttr
+
+# ---------------------------------------------------------------------------
+#   Shared, pooled Ollama clients
+# ---------------------------------------------------------------------------
+# Every chain used to build its own OllamaLLM – and with it its own HTTP
+# client and TCP connections – per chain, per MemoryManager and per SD prompt.
+# `get_llm(model, **options)` hands out one instance per (model, options);
+# all instances talking to the same server share a single keep-alive
+# connection pool, and each instance caps how many requests it has open.
+# Async calls wait on an asyncio.Semaphore of their own event loop, so a
+# waiting request holds no executor thread and cancelling it holds no slot.
+#   MAX_CONNECTIONS   keep-alive pool size per Ollama host
+#   MAX_CONCURRENCY   simultaneous requests per (model, options)
+# ---------------------------------------------------------------------------
+
+MAX_CONNECTIONS = int(os.getenv("LLM_MAX_CONNECTIONS", "8"))
+MAX_CONCURRENCY = int(os.getenv("LLM_MAX_CONCURRENCY", "4"))
+KEEPALIVE_EXPIRY = 300.0  # seconds an idle connection is kept open
+
+_lock = threading.Lock()
+_llms: Dict[Tuple, "PooledOllamaLLM"] = {}
+_hosts: Dict[str, Tuple[Any, Any]] = {}   # base_url → (Client, AsyncClient)
+
+
+class _Slot:
+    """Concurrency cap + in-flight counter of one registry entry."""
+
+    def __init__(self, limit: int):
+        self.limit = limit
+        self.sem = threading.BoundedSemaphore(limit)
+        self.lock = threading.Lock()
+        self.in_flight = 0
+        self.requests = 0
+        self._loop_sems: "weakref.WeakKeyDictionary[asyncio.AbstractEventLoop, asyncio.Semaphore]" = \
+            weakref.WeakKeyDictionary()
+
+    def _count(self, step: int):
+        with self.lock:
+            self.in_flight += step
+            if step > 0:
+                self.requests += 1
+
+    def enter(self):
+        self.sem.acquire()
+        self._count(1)
+
+    def leave(self):
+        self._count(-1)
+        self.sem.release()
+
+    async def aenter(self) -> asyncio.Semaphore:
+        """Async acquire; a cancelled wait leaves nothing acquired."""
+        loop = asyncio.get_running_loop()
+        with self.lock:
+            sem = self._loop_sems.get(loop)
+            if sem is None:
+                sem = self._loop_sems[loop] = asyncio.Semaphore(self.limit)
+        await sem.acquire()
+        self._count(1)
+        return sem
+
+    def aleave(self, sem: asyncio.Semaphore):
+        self._count(-1)
+        sem.release()
+
+
+class PooledOllamaLLM(OllamaLLM):
+    """OllamaLLM whose calls go through its registry slot."""
+
+    _slot: _Slot = PrivateAttr(default_factory=lambda: _Slot(MAX_CONCURRENCY))
+
+    def _generate(self, *args, **kwargs):
+        self._slot.enter()
+        try:
+            return super()._generate(*args, **kwargs)
+        finally:
+            self._slot.leave()
+
+    def _stream(self, *args, **kwargs):
+        self._slot.enter()
+        try:
+            yield from super()._stream(*args, **kwargs)
+        finally:
+            self._slot.leave()
+
+    async def _agenerate(self, *args, **kwargs):
+        sem = await self._slot.aenter()
+        try:
+            return await super()._agenerate(*args, **kwargs)
+        finally:
+            self._slot.aleave(sem)
+
+    async def _astream(self, *args, **kwargs):
+        sem = await self._slot.aenter()
+        try:
+            async for chunk in super()._astream(*args, **kwargs):
+                yield chunk
+        finally:
+            self._slot.aleave(sem)
+
+
+def _limits() -> httpx.Limits:
+    return httpx.Limits(
+        max_connections=MAX_CONNECTIONS,
+        max_keepalive_connections=MAX_CONNECTIONS,
+        keepalive_expiry=KEEPALIVE_EXPIRY,
+    )
+
+
+def get_llm(model: str, **options) -> PooledOllamaLLM:
+    """
+    Shared LLM for `model` with these OllamaLLM options (num_ctx, keep_alive,
+    temperature, …). Same arguments → same instance.
+    """
+    key = (model, tuple(sorted(options.items())))
+    with _lock:
+        llm = _llms.get(key)
+        if llm is not None:
+            return llm
+        llm = PooledOllamaLLM(model=model, client_kwargs={"limits": _limits()}, **options)
+        host = llm.base_url or ""
+        if host in _hosts:   # reuse the host's connection pool
+            llm._client, llm._async_client = _hosts[host]
+        else:
+            _hosts[host] = (llm._client, llm._async_client)
+        _llms[key] = llm
+        return llm
+
+
+def _pool_size(client) -> int:
+    try:
+        return len(client._client._transport._pool.connections)
+    except AttributeError:   # client internals changed – report nothing
+        return 0
+
+
+def registry_stats() -> Dict[str, int]:
+    """Counters for the debug view: clients, requests in flight / total, open connections."""
+    with _lock:
+        llms = list(_llms.values())
+        hosts = list(_hosts.values())
+    return {
+        "clients": len(llms),
+        "in_flight": sum(llm._slot.in_flight for llm in llms),
+        "requests": sum(llm._slot.requests for llm in llms),
+        "open_connections": sum(_pool_size(c) + _pool_size(ac) for c, ac in hosts),
+    }
@@ -1,17 +1,54 @@
 # Updated utils/memory.py with RunnableSequence.invoke fixes
 
 import json
-from typing import List, Dict
-from langchain_ollama import OllamaLLM
+import os
+import threading
+from collections import deque
+from typing import Callable, Deque, List, Dict, Optional, Set, Tuple
+
+import numpy as np
 from langchain_core.prompts import ChatPromptTemplate
 
+from utils.embeddings import make_embedder
+from utils.fact_index import BM25Index, VectorIndex
+from utils.fact_store import FactStore
+from utils.llm_registry import get_llm
+
 
 class MemoryManager:
     """
     Manages a rolling summary and a simple key–value store of extracted facts/feelings.
+
+    Completed turns can be handed to `submit_turn`, which queues them for a
+    background worker so the memory LLM call(s) stay off the chat's
+    critical path. If several turns pile up while the worker is busy they are
+    folded into a single update. Readers use `read_context` to get the
+    summary and facts as one consistent snapshot.
+
+    Facts are indexed once when stored. retrieval="vector" embeds them into a
+    `VectorIndex` (pluggable embedder, see utils.embeddings; defaults to the
+    offline hashing embedder, or MEMORY_EMBEDDER). retrieval="bm25" is the
+    model-free alternative: a CJK-aware `BM25Index` that is always kept up
+    to date. retrieval="keyword" is the old substring scan.
+
+    Facts live in a bounded `FactStore` (at most `max_facts`): repeats are
+    merged on insert, low-value facts are evicted and related ones are
+    consolidated from time to time; see `memory_stats`.
+
+    `bind_store` attaches a durable `MemoryStore` for one (user, character):
+    state is restored from it, and from then on facts are appended, evicted
+    facts deleted and the summary checkpointed as they change.
     """
 
-    def __init__(self, model_name: str = "llama3"):
+    def __init__(
+        self,
+        model_name: str = "llama3",
+        background: bool = True,
+        combined: bool = True,
+        embedder=None,
+        retrieval: str = "vector",
+        max_facts: int = 2000
+    ):
         # ── Summary chain ─────────────────────────────────────────────────
         self.summary = ""
         summary_tpl = ChatPromptTemplate.from_template(
@@ -24,7 +61,7 @@ Assistant: {assistant_reply}
 
 Please provide a concise, one-paragraph UPDATED summary that includes any new facts or emotional shifts."""
         )
-        self._summary_chain = summary_tpl | OllamaLLM(model=model_name)
+        self._summary_chain = summary_tpl | get_llm(model_name)
 
         # ── Extraction chain ────────────────────────────────────────────────
         extract_tpl = ChatPromptTemplate.from_template(
@@ -38,22 +75,75 @@ List any new facts or feelings in JSON, like:
   {{ "type": "feeling", "text": "…" }}
 ]"""
         )
-        self._extract_chain = extract_tpl | OllamaLLM(model=model_name)
+        self._extract_chain = extract_tpl | get_llm(model_name)
+
+        # ── Combined chain: summary + extraction in one structured call ────
+        # The two chains above see the same turn, so by default one JSON
+        # answer carries both; they stay as the fallback when it won't parse.
+        self.combined = combined
+        combined_tpl = ChatPromptTemplate.from_template(
+            """Here is the current story summary:
+{old_summary}
+
+The conversation just added:
+User: {user_input}
+Assistant: {assistant_reply}
+
+Answer with ONE valid JSON object and nothing else:
+{{
+  "summary": "a concise, one-paragraph UPDATED summary that includes any new facts or emotional shifts",
+  "facts": [
+    {{ "type": "fact", "text": "…" }},
+    {{ "type": "feeling", "text": "…" }}
+  ]
+}}"""
+        )
+        self._combined_chain = combined_tpl | get_llm(model_name)
 
         # In-memory store
-        self.fact_memory: List[Dict[str, str]] = []
+        self.facts = FactStore(capacity=max_facts, on_remove=self._unindex)
+        self.turn = 0
+
+        # ── Retrieval indexes ───────────────────────────────────────────────
+        self.retrieval = retrieval
+        self.embedder = None
+        self._vectors: Optional[VectorIndex] = None
+        if retrieval == "vector":
+            self.embedder = embedder or make_embedder(os.environ.get("MEMORY_EMBEDDER", "hashing"))
+            self._vectors = VectorIndex(self.embedder.dim)
+        self._bm25 = BM25Index()
+
+        # ── Background update pipeline ──────────────────────────────────────
+        # _lock guards summary + facts + indexes; _cond guards the pending queue.
+        self.background = background
+        self._lock = threading.RLock()
+        self._cond = threading.Condition()
+        self._pending: Deque[Tuple[str, str, Optional[Callable[[], None]]]] = deque()
+        self._busy = False
+        self._closed = False
+        self._worker: Optional[threading.Thread] = None
+
+        # ── Persistence (see bind_store) ────────────────────────────────────
+        self._store = None
+        self._store_key: Tuple[str, str] = ("", "")
+        self._removed: List[int] = []
+        self._touched: Set[int] = set()
 
     def update_summary(self, user_input: str, assistant_reply: str) -> str:
         """
         Calls the summarization chain to roll your summary forward.
         """
+        with self._lock:
+            old_summary = self.summary
         # Use invoke instead of run on the RunnableSequence
         new_sum = self._summary_chain.invoke({
-            "old_summary":     self.summary,
+            "old_summary":     old_summary,
             "user_input":      user_input,
             "assistant_reply": assistant_reply
         })
-        self.summary = new_sum.strip()
+        with self._lock:
+            self.summary = new_sum.strip()
+        self._persist(summary=True)
         return self.summary
 
     def extract_facts(self, user_input: str, assistant_reply: str) -> List[Dict[str, str]]:
@@ -67,23 +157,320 @@ List any new facts or feelings in JSON, like:
         })
         try:
             items = json.loads(raw)
-            # only keep well-formed entries
-            valid = [i for i in items 
-                     if isinstance(i, dict) and "type" in i and "text" in i]
-            self.fact_memory.extend(valid)
-            return valid
         except json.JSONDecodeError:
             return []
+        return self._store_facts(items)
+
+    def update_memory(self, user_input: str, assistant_reply: str) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Roll the summary forward and extract facts for one turn.
+        Uses the single combined call when enabled, and falls back to the
+        separate summary + extraction chains if its answer is not valid.
+        """
+        if self.combined:
+            with self._lock:
+                old_summary = self.summary
+            raw = self._combined_chain.invoke({
+                "old_summary":     old_summary,
+                "user_input":      user_input,
+                "assistant_reply": assistant_reply
+            })
+            parsed = self._parse_combined(raw)
+            if parsed is not None:
+                new_sum, items = parsed
+                with self._lock:
+                    self.summary = new_sum
+                stored = self._store_facts(items)
+                self._persist(summary=True)
+                return self.summary, stored
+            print("⚠️ Combined memory update was not valid JSON – using two-chain fallback")
+
+        return (self.update_summary(user_input, assistant_reply),
+                self.extract_facts(user_input, assistant_reply))
+
+    @staticmethod
+    def _parse_combined(raw: str) -> Optional[Tuple[str, list]]:
+        """
+        Validate the combined answer into (summary, fact items) or None.
+        Tolerates a ```json fence and chatter around the object.
+        """
+        start, end = raw.find("{"), raw.rfind("}")
+        if start < 0 or end <= start:
+            return None
+        try:
+            data = json.loads(raw[start:end + 1])
+        except json.JSONDecodeError:
+            return None
+        if not isinstance(data, dict):
+            return None
+        summary, facts = data.get("summary"), data.get("facts", [])
+        if not isinstance(summary, str) or not summary.strip() or not isinstance(facts, list):
+            return None
+        return summary.strip(), facts
+
+    def _store_facts(self, items) -> List[Dict[str, str]]:
+        """
+        Keep only well-formed {"type", "text"} entries and add them to memory.
+        """
+        if not isinstance(items, list):
+            return []
+        valid = [i for i in items
+                 if isinstance(i, dict) and "type" in i and "text" in i]
+        if not valid:
+            return []
+
+        stored, new = [], []
+        with self._lock:
+            self.turn += 1
+            for item in valid:
+                text = str(item["text"]).strip()
+                # near-duplicates can only be among facts sharing terms
+                candidates = [fid for fid, _ in self._bm25.search(text, 5)]
+                fact, is_new = self.facts.add(str(item["type"]), text, self.turn, candidates)
+                if is_new:
+                    self._bm25.add(fact["id"], text)
+                    new.append(fact)
+                stored.append(fact)
+
+            if self._store is not None:
+                new_ids = {f["id"] for f in new}
+                self._touched.update(f["id"] for f in stored if f["id"] not in new_ids)
+
+        # embed outside the lock – a remote embedder may take a while
+        blobs: Dict[int, bytes] = {}
+        if self._vectors is not None and new:
+            vecs = self.embedder.embed_documents([f["text"] for f in new])
+            with self._lock:
+                keep = [i for i, fact in enumerate(new) if fact["id"] in self.facts]
+                self._vectors.add_many([new[i]["id"] for i in keep], vecs[keep])
+                for i in keep:
+                    blobs[new[i]["id"]] = vecs[i].tobytes()
+
+        with self._lock:
+            self.facts.evict(self.turn)
+            if self.facts.due_for_consolidation():
+                self.facts.consolidate(
+                    lambda f: [fid for fid, _ in self._bm25.search(f["text"], 5)])
+        self._persist(new=new, blobs=blobs)
+        return stored
+
+    def remove_fact(self, fid: int) -> bool:
+        """
+        Forget one stored fact and drop it from every index.
+        """
+        with self._lock:
+            removed = self.facts.remove(fid)
+        self._persist()
+        return removed
+
+    def _unindex(self, fid: int):
+        """FactStore callback: a fact left the store (caller holds the lock)."""
+        self._bm25.remove(fid)
+        if self._vectors is not None:
+            self._vectors.remove(fid)
+        if self._store is not None:
+            self._removed.append(fid)
+            self._touched.discard(fid)
+
+    # ── Persistence ────────────────────────────────────────────────────────
+    def bind_store(self, store, user: str, character: str):
+        """
+        Attach `store` for (user, character) and replace the in-memory state
+        with what it holds. Facts saved without a usable vector (other
+        embedder, or retrieval mode changed) are re-embedded once.
+        """
+        self.flush()
+        summary, turn, facts, blobs = store.load(user, character)
+        missing: List[Dict] = []
+        with self._lock:
+            self.summary, self.turn = summary, turn
+            self.facts.clear()
+            self._bm25 = BM25Index()
+            if self._vectors is not None:
+                self._vectors = VectorIndex(self.embedder.dim)
+            saved: List[int] = []
+            for fact in facts:
+                self.facts.restore(fact)
+                self._bm25.add(fact["id"], fact["text"])
+                if self._vectors is None:
+                    continue
+                blob = blobs.get(fact["id"])
+                if blob is not None and len(blob) == self.embedder.dim * 4:
+                    saved.append(fact["id"])
+                else:
+                    missing.append(fact)
+            if saved:
+                mat = np.frombuffer(b"".join(blobs[fid] for fid in saved), dtype=np.float32)
+                self._vectors.add_many(saved, mat.reshape(len(saved), self.embedder.dim))
+            self._removed.clear()
+            self._touched.clear()
+            self._store, self._store_key = store, (user, character)
+
+        if missing:
+            vecs = self.embedder.embed_documents([f["text"] for f in missing])
+            with self._lock:
+                self._vectors.add_many([f["id"] for f in missing], vecs)
+            store.append_facts(user, character, missing,
+                               {f["id"]: v.tobytes() for f, v in zip(missing, vecs)})
+
+    def _persist(self, new: Optional[List[Dict]] = None, blobs: Optional[Dict[int, bytes]] = None,
+                 summary: bool = False):
+        """
+        Write what changed since the last call: appended facts, hit/recency
+        updates, deletions and, with summary=True, a summary checkpoint.
+        """
+        with self._lock:
+            store = self._store
+            if store is None:
+                return
+            user, character = self._store_key
+            new = [dict(f) for f in (new or []) if f["id"] in self.facts]
+            touched = [dict(self.facts.get(fid)) for fid in self._touched if fid in self.facts]
+            removed = list(self._removed)
+            self._touched.clear()
+            self._removed.clear()
+            cur_summary, turn = self.summary, self.turn
+        store.append_facts(user, character, new, blobs)
+        store.update_fact_stats(user, character, touched)
+        store.delete_facts(user, character, removed)
+        if summary:
+            store.checkpoint_summary(user, character, cur_summary, turn)
+
+    @property
+    def fact_memory(self) -> List[Dict[str, str]]:
+        """All stored facts, oldest first (a snapshot copy of the list)."""
+        with self._lock:
+            return self.facts.facts()
+
+    def memory_stats(self) -> Dict[str, int]:
+        """Fact-store size and insert / duplicate / eviction / merge counters."""
+        with self._lock:
+            return {"size": len(self.facts), "capacity": self.facts.capacity,
+                    "turn": self.turn, **self.facts.stats}
 
     def get_relevant_facts(self, query: str, top_k: int = 5) -> List[Dict[str, str]]:
         """
-        Naïve keyword lookup: return the first top_k facts whose text
-        contains any word from `query`. Adaptable to embeddings.
+        Return the top_k facts most relevant to `query`, best first.
+        With retrieval="keyword": the first top_k facts whose text contains
+        any word from `query`.
+        """
+        qvec = self._embed_query(query)
+        with self._lock:
+            return self._lookup(query, qvec, top_k)
+
+    def _embed_query(self, query: str):
+        if self.retrieval != "vector" or not query.strip():
+            return None
+        return self.embedder.embed_query(query)
+
+    def _lookup(self, query: str, qvec, top_k: int) -> List[Dict[str, str]]:
+        """Caller holds self._lock."""
+        if not query.strip():
+            return []
+        if self.retrieval == "keyword":
+            qwords = set(query.lower().split())
+            hits = [f for f in self.facts.facts()
+                    if any(w in f["text"].lower() for w in qwords)][:top_k]
+        elif self.retrieval == "bm25":
+            hits = [self.facts.get(fid) for fid, _ in self._bm25.search(query, top_k)]
+        else:
+            hits = [self.facts.get(fid) for fid, _ in self._vectors.search(qvec, top_k)]
+        # retrieval counts as use – keeps these facts away from eviction
+        self.facts.touch([f["id"] for f in hits], self.turn)
+        if self._store is not None:
+            self._touched.update(f["id"] for f in hits)
+        return hits
+
+    def read_context(self, query: str, top_k: int = 5) -> Tuple[str, List[Dict[str, str]]]:
+        """
+        Return (summary, relevant facts) taken under one lock, so a background
+        update can never pair a new summary with stale facts or vice versa.
+        """
+        qvec = self._embed_query(query)
+        with self._lock:
+            return self.summary, self._lookup(query, qvec, top_k)
+
+    # ── Background pipeline ────────────────────────────────────────────────
+    def submit_turn(
+        self,
+        user_input: str,
+        assistant_reply: str,
+        on_done: Optional[Callable[[], None]] = None
+    ) -> None:
+        """
+        Queue a finished turn for summary + fact extraction and return at once.
+        `on_done` runs on the worker thread after the update has been applied.
+        With background=False the update runs inline instead.
+        """
+        if not self.background:
+            self._apply_turns([(user_input, assistant_reply, on_done)])
+            return
+        with self._cond:
+            self._pending.append((user_input, assistant_reply, on_done))
+            if self._worker is None or not self._worker.is_alive():
+                self._worker = threading.Thread(
+                    target=self._run_worker, daemon=True, name="memory-worker")
+                self._worker.start()
+            self._cond.notify()
+
+    def flush(self, timeout: Optional[float] = None) -> bool:
+        """
+        Block until every queued turn has been applied. Returns False on timeout.
+        """
+        with self._cond:
+            return self._cond.wait_for(
+                lambda: not self._pending and not self._busy, timeout)
+
+    def is_idle(self) -> bool:
+        """True when no turn is queued or being applied."""
+        with self._cond:
+            return not self._pending and not self._busy
+
+    def close(self):
+        """
+        Apply queued turns, write outstanding fact stats and let the worker
+        thread exit. Turns submitted afterwards are still applied (and
+        persisted) by a short-lived worker.
+        """
+        self.flush()
+        self._persist()
+        with self._cond:
+            self._closed = True
+            self._cond.notify_all()
+
+    def _run_worker(self):
+        while True:
+            with self._cond:
+                self._cond.wait_for(lambda: self._pending or self._closed)
+                if not self._pending:
+                    self._worker = None
+                    return
+                batch = list(self._pending)
+                self._pending.clear()
+                self._busy = True
+            try:
+                self._apply_turns(batch)
+            except Exception as exc:  # keep the worker alive for later turns
+                print(f"⚠️ Memory update failed: {exc}")
+            finally:
+                with self._cond:
+                    self._busy = False
+                    self._cond.notify_all()
+
+    def _apply_turns(self, batch: List[Tuple[str, str, Optional[Callable[[], None]]]]):
+        """
+        Apply one or more queued turns with a single summary + extract pass.
+        Earlier turns are folded into the user side of the prompt so the model
+        still sees them in order: "User: u1 / Assistant: a1 / User: u2 / …".
         """
-        qwords = set(query.lower().split())
-        hits = [f for f in self.fact_memory
-                if any(w in f["text"].lower() for w in qwords)]
-        return hits[:top_k]
+        *earlier, (user_input, assistant_reply, _) = batch
+        if earlier:
+            parts = [f"{u}\nAssistant: {a}" for u, a, _ in earlier] + [user_input]
+            user_input = "\nUser: ".join(parts)
+        self.update_memory(user_input, assistant_reply)
+        for _, _, cb in batch:
+            if cb:
+                cb()
 
     def trim_context(self, turns: List[str], max_turns: int = 20) -> List[str]:
         """
@@ -0,0 +1,219 @@
+import os
+import threading
+import time
+from collections import OrderedDict
+from contextlib import contextmanager
+from typing import Dict, Iterator, List, Optional, Tuple
+
+from utils.embeddings import make_embedder
+from utils.memory import MemoryManager
+
+# ---------------------------------------------------------------------------
+#   Per-session memories with idle hibernation
+# ---------------------------------------------------------------------------
+# One MemoryManager per (user, character, chat), so characters and chats no
+# longer share a summary or fact list. A bound manager already writes every
+# change through to its MemoryStore, so hibernating is cheap: wait for its
+# queued turns, write the last fact stats, let its worker thread exit and
+# drop it. The next `get` restores it from the store with one indexed read,
+# outside the registry lock, so a slow restore only holds up its own chat.
+# At most `max_resident` managers are kept (least recently used go first)
+# and a sweeper hibernates those idle for `idle_timeout`, so the process
+# does not grow with the number of chats opened. A session under `lease`
+# (a turn in progress) is never hibernated. All managers share one
+# embedder and the pooled LLM clients.
+#   MEMORY_MAX_RESIDENT   managers kept in memory      (default 16)
+#   MEMORY_IDLE_TIMEOUT   seconds before hibernation   (default 600)
+# ---------------------------------------------------------------------------
+
+MAX_RESIDENT = int(os.getenv("MEMORY_MAX_RESIDENT", "16"))
+IDLE_TIMEOUT = float(os.getenv("MEMORY_IDLE_TIMEOUT", "600"))
+
+SessionKey = Tuple[str, str, str]   # (user, character, chat)
+
+
+def store_name(character: str, chat: str = "") -> str:
+    """MemoryStore character key; the default chat keeps the plain name of older saves."""
+    return f"{character}#{chat}" if chat else character
+
+
+class _Entry:
+    __slots__ = ("memory", "used")
+
+    def __init__(self, memory: MemoryManager):
+        self.memory = memory
+        self.used = time.monotonic()
+
+
+class MemoryRegistry:
+    """
+    Hands out the MemoryManager of a (user, character, chat) session,
+    restoring it from `store` if it is not resident. Thread-safe.
+    Extra keyword arguments are passed to every MemoryManager.
+    """
+
+    def __init__(
+        self,
+        store,
+        model_name: str = "llama3.2",
+        max_resident: int = MAX_RESIDENT,
+        idle_timeout: float = IDLE_TIMEOUT,
+        **options
+    ):
+        self.store = store
+        self.model_name = model_name
+        self.max_resident = max(1, max_resident)
+        self.idle_timeout = idle_timeout
+        self.options = options
+        self._lock = threading.Lock()
+        self._resident: "OrderedDict[SessionKey, _Entry]" = OrderedDict()   # least recently used first
+        self._retiring: Dict[SessionKey, MemoryManager] = {}   # being hibernated right now
+        self._opening: Dict[SessionKey, threading.Event] = {}   # being restored right now
+        self._leases: Dict[SessionKey, int] = {}                 # turns in progress
+        self._embedder = None
+        self._embedder_lock = threading.Lock()
+        self._sweeper: Optional[threading.Thread] = None
+        self._stop = threading.Event()
+        self.stats = {"opened": 0, "hibernated": 0}
+
+    # ── API ────────────────────────────────────────────────────────────────
+    def get(self, user: str, character: str, chat: str = "") -> MemoryManager:
+        """The session's memory; counts as use for the idle timeout and LRU order."""
+        key = (user, character, chat)
+        while True:
+            with self._lock:
+                entry = self._resident.get(key)
+                if entry is not None:
+                    entry.used = time.monotonic()
+                    self._resident.move_to_end(key)
+                    return entry.memory
+                opening = self._opening.get(key)
+                if opening is None:   # ours to restore
+                    opening = self._opening[key] = threading.Event()
+                    retiring = self._retiring.pop(key, None)
+                    break
+            opening.wait()            # another thread is restoring it; then look again
+
+        # store I/O happens outside the lock so other sessions are not held up
+        try:
+            memory = self._open(key, retiring)
+        except BaseException:
+            with self._lock:
+                del self._opening[key]
+            opening.set()
+            raise
+        with self._lock:
+            del self._opening[key]
+            self._resident[key] = _Entry(memory)
+            self.stats["opened"] += 1
+            victims = self._take(self._over_cap())
+            self._start_sweeper()
+        opening.set()
+        self._hibernate(victims)
+        return memory
+
+    @contextmanager
+    def lease(self, user: str, character: str, chat: str = "") -> Iterator[None]:
+        """
+        Keep the session resident for the duration of the block – a turn
+        from reading its memory to submit_turn. A manager counts as idle
+        while the reply is still streaming, so without this it could be
+        hibernated mid-turn and the finished turn would land on a retired copy.
+        """
+        key = (user, character, chat)
+        with self._lock:
+            self._leases[key] = self._leases.get(key, 0) + 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                if self._leases[key] > 1:
+                    self._leases[key] -= 1
+                else:
+                    del self._leases[key]
+
+    def sweep(self) -> int:
+        """Hibernate every session idle for longer than `idle_timeout`."""
+        cutoff = time.monotonic() - self.idle_timeout
+        with self._lock:
+            victims = self._take([k for k, e in self._resident.items()
+                                  if e.used < cutoff and self._idle(k, e)])
+            for key, memory in list(self._retiring.items()):
+                if memory.is_idle() and (key, memory) not in victims:   # late turn has landed
+                    del self._retiring[key]
+        self._hibernate(victims)
+        return len(victims)
+
+    def close(self):
+        """Stop the sweeper and hibernate everything (waits for queued turns)."""
+        self._stop.set()
+        with self._lock:
+            victims = self._take(list(self._resident))
+        self._hibernate(victims)
+
+    def session_stats(self) -> Dict[str, int]:
+        with self._lock:
+            return dict(self.stats, resident=len(self._resident))
+
+    # ── internals ──────────────────────────────────────────────────────────
+    def _open(self, key: SessionKey, retiring: Optional[MemoryManager]) -> MemoryManager:
+        """Restore `key` from the store. Runs without the lock; `key` is marked as opening."""
+        if retiring is not None:     # reopened mid-hibernation: its last turn must reach the store
+            retiring.flush()
+        with self._embedder_lock:
+            if self._embedder is None and self.options.get("retrieval", "vector") == "vector":
+                self._embedder = make_embedder(os.environ.get("MEMORY_EMBEDDER", "hashing"))
+        user, character, chat = key
+        memory = MemoryManager(model_name=self.model_name, embedder=self._embedder, **self.options)
+        memory.bind_store(self.store, user, store_name(character, chat))
+        return memory
+
+    def _idle(self, key: SessionKey, entry: _Entry) -> bool:
+        """No turn leased and none queued. Caller holds the lock."""
+        return key not in self._leases and entry.memory.is_idle()
+
+    def _over_cap(self) -> List[SessionKey]:
+        """Oldest idle sessions beyond max_resident; busy ones are passed over. Caller holds the lock."""
+        excess = len(self._resident) - self.max_resident
+        keys = []
+        for key, entry in self._resident.items():
+            if excess <= 0:
+                break
+            if self._idle(key, entry):
+                keys.append(key)
+                excess -= 1
+        return keys
+
+    def _take(self, keys: List[SessionKey]) -> List[Tuple[SessionKey, MemoryManager]]:
+        """Move sessions from resident to retiring. Caller holds the lock."""
+        victims = []
+        for key in keys:
+            memory = self._resident.pop(key).memory
+            self._retiring[key] = memory
+            victims.append((key, memory))
+        return victims
+
+    def _hibernate(self, victims: List[Tuple[SessionKey, MemoryManager]]):
+        for key, memory in victims:
+            try:
+                memory.close()
+            except Exception as exc:  # the store already has everything but the last stats
+                print(f"⚠️ Hibernating memory {key} failed: {exc}")
+            with self._lock:
+                if self._retiring.get(key) is memory and memory.is_idle():
+                    del self._retiring[key]
+                self.stats["hibernated"] += 1
+
+    def _start_sweeper(self):
+        """Caller holds the lock."""
+        if self._sweeper is None and self.idle_timeout > 0:
+            self._sweeper = threading.Thread(target=self._run_sweeper, daemon=True, name="memory-sweeper")
+            self._sweeper.start()
+
+    def _run_sweeper(self):
+        interval = min(60.0, max(1.0, self.idle_timeout / 4))
+        while not self._stop.wait(interval):
+            try:
+                self.sweep()
+            except Exception as exc:
+                print(f"⚠️ Memory sweep failed: {exc}")
@@ -0,0 +1,120 @@
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict, Iterable, List, Optional, Tuple
+
+from utils.user_data import USER_DATA_DIR
+
+# ---------------------------------------------------------------------------
+#   Durable MemoryManager state, one row set per (user, character)
+# ---------------------------------------------------------------------------
+# SQLite in WAL mode under users/. Facts are appended as they are extracted
+# (and deleted when evicted); the summary is checkpointed after each update.
+# Restoring a chat is a single indexed read, so a long relationship resumes
+# without re-summarising its history through the LLM.
+# ---------------------------------------------------------------------------
+
+MEMORY_DB_PATH = os.path.join(USER_DATA_DIR, "memory.db")
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS summaries (
+    user      TEXT NOT NULL,
+    character TEXT NOT NULL,
+    summary   TEXT NOT NULL DEFAULT '',
+    turn      INTEGER NOT NULL DEFAULT 0,
+    updated   REAL NOT NULL,
+    PRIMARY KEY (user, character)
+);
+CREATE TABLE IF NOT EXISTS facts (
+    user      TEXT NOT NULL,
+    character TEXT NOT NULL,
+    fid       INTEGER NOT NULL,
+    type      TEXT NOT NULL,
+    text      TEXT NOT NULL,
+    hits      INTEGER NOT NULL DEFAULT 0,
+    turn      INTEGER NOT NULL DEFAULT 0,
+    vec       BLOB,
+    PRIMARY KEY (user, character, fid)
+);
+"""
+
+
+class MemoryStore:
+    """
+    Thread-safe SQLite backend for MemoryManager (one shared connection,
+    serialised by a lock; the memory worker and the GUI thread both use it).
+    """
+
+    def __init__(self, path: str = MEMORY_DB_PATH):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def load(self, user: str, character: str) -> Tuple[str, int, List[Dict], Dict[int, bytes]]:
+        """
+        Return (summary, turn, facts oldest first, {fid: vector blob}).
+        Creates the (empty) summary row on first use.
+        """
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO summaries (user, character, updated) VALUES (?, ?, ?)",
+                (user, character, time.time()))
+            rows = self._db.execute(
+                """SELECT s.summary, s.turn, f.fid, f.type, f.text, f.hits, f.turn, f.vec
+                   FROM summaries s
+                   LEFT JOIN facts f ON f.user = s.user AND f.character = s.character
+                   WHERE s.user = ? AND s.character = ?
+                   ORDER BY f.fid""",
+                (user, character)).fetchall()
+        summary, turn = rows[0][0], rows[0][1]
+        facts, vecs = [], {}
+        for _, _, fid, ftype, text, hits, fturn, vec in rows:
+            if fid is None:
+                continue
+            facts.append({"id": fid, "type": ftype, "text": text, "hits": hits, "turn": fturn})
+            if vec is not None:
+                vecs[fid] = vec
+        return summary, turn, facts, vecs
+
+    def append_facts(self, user: str, character: str, facts: Iterable[Dict],
+                     vecs: Optional[Dict[int, bytes]] = None):
+        vecs = vecs or {}
+        rows = [(user, character, f["id"], f["type"], f["text"], f["hits"], f["turn"], vecs.get(f["id"]))
+                for f in facts]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "INSERT OR REPLACE INTO facts VALUES (?, ?, ?, ?, ?, ?, ?, ?)", rows)
+
+    def update_fact_stats(self, user: str, character: str, facts: Iterable[Dict]):
+        rows = [(f["hits"], f["turn"], user, character, f["id"]) for f in facts]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "UPDATE facts SET hits = ?, turn = ? WHERE user = ? AND character = ? AND fid = ?", rows)
+
+    def delete_facts(self, user: str, character: str, fids: Iterable[int]):
+        rows = [(user, character, fid) for fid in fids]
+        if not rows:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                "DELETE FROM facts WHERE user = ? AND character = ? AND fid = ?", rows)
+
+    def checkpoint_summary(self, user: str, character: str, summary: str, turn: int):
+        with self._lock, self._db:
+            self._db.execute(
+                """INSERT INTO summaries (user, character, summary, turn, updated) VALUES (?, ?, ?, ?, ?)
+                   ON CONFLICT (user, character) DO UPDATE
+                   SET summary = excluded.summary, turn = excluded.turn, updated = excluded.updated""",
+                (user, character, summary, turn, time.time()))
@@ -1,51 +1,270 @@
 import numpy as np
-from sklearn.metrics.pairwise import cosine_similarity
-from utils.character_loader import load_all_characters
-from utils.user_data import extract_user_tags
+from scipy.sparse import csr_matrix
+from typing import Dict, Hashable, Iterable, List, Optional, Tuple
+from utils.character_loader import list_characters
+from utils.user_data import on_user_tags
 
-# Convert tags to a vector based on a unified tag universe
-def tag_vector(tags, tag_universe):
-    return [1 if tag in tags else 0 for tag in tag_universe]
+# ---------------------------------------------------------------------------
+#   Tag-similarity recommender
+# ---------------------------------------------------------------------------
+# Characters are rows of one sparse 0/1 character×tag matrix (tag → column
+# dict, row norms precomputed). Ranking is a single sparse mat-vec against
+# the user's tag vector, cosine-normalised with the stored norms, followed by
+# an argpartition top-n – no per-character Python loop. Rows are added or
+# replaced one at a time as the catalog changes; the CSR arrays are rebuilt
+# lazily, once, before the next query.
+#
+# Per user, UserRecommendations keeps the count-weighted preference vector,
+# every character's dot product with it and the current top-N. A chat only
+# adds a few tag counts (update_user_tags → sparse delta), so only the rows
+# carrying those tags are re-scored and merged into the top-N; the homepage
+# just reads the result.
+# ---------------------------------------------------------------------------
+
+
+class TagMatrix:
+    """Sparse character×tag matrix with incremental row updates."""
+
+    def __init__(self):
+        self.columns: Dict[str, int] = {}        # tag → column
+        self._row: Dict[Hashable, int] = {}      # character key → row
+        self._items: List[object] = []           # row → character (None once removed)
+        self._cols: List[np.ndarray] = []        # row → sorted unique columns
+        self._stamp: List[object] = []           # row → version marker (e.g. file mtime)
+        self._csr: Optional[csr_matrix] = None
+        self._norms: Optional[np.ndarray] = None
+        self._csc: Optional[csr_matrix] = None   # column view, for sparse deltas
+        self._built = 0                          # rows contained in _csr
+        self._stale = True                       # a built row changed → full rebuild
+        self.version = 0                         # bumped on every row change
+
+    def __len__(self) -> int:
+        return len(self._row)
+
+    def _column(self, tag: str) -> int:
+        col = self.columns.get(tag)
+        if col is None:
+            col = self.columns[tag] = len(self.columns)
+        return col
+
+    def set_row(self, key: Hashable, item, tags: Iterable[str], stamp=None):
+        """Insert or replace one character's tags."""
+        cols = np.unique(np.fromiter((self._column(t) for t in tags), dtype=np.int32))
+        row = self._row.get(key)
+        if row is None:
+            row = self._row[key] = len(self._items)
+            self._items.append(item)
+            self._cols.append(cols)
+            self._stamp.append(stamp)
+        else:
+            self._items[row], self._cols[row], self._stamp[row] = item, cols, stamp
+            self._stale = True
+        self.version += 1
+
+    def remove(self, key: Hashable):
+        row = self._row.pop(key, None)
+        if row is not None:                       # keep the slot, just empty it
+            self._items[row] = None
+            self._cols[row] = np.empty(0, dtype=np.int32)
+            self._stale = True
+            self.version += 1
+
+    def stamp(self, key: Hashable):
+        row = self._row.get(key)
+        return None if row is None else self._stamp[row]
+
+    def keys(self) -> List[Hashable]:
+        return list(self._row)
+
+    def _build(self):
+        """Bring the CSR arrays up to date: append new rows, or rebuild after edits."""
+        shape = (len(self._cols), len(self.columns))
+        if not self._stale and self._csr is not None and self._csr.shape == shape:
+            return
+        start = 0 if self._stale or self._csr is None else self._built
+        new = self._cols[start:]
+        lengths = np.fromiter((len(c) for c in new), dtype=np.int64, count=len(new))
+        indptr = np.cumsum(lengths)
+        indices = np.concatenate(new) if new else np.empty(0, dtype=np.int32)
+        if start:                                 # only appended rows: extend the arrays
+            old = self._csr
+            indptr = np.concatenate((old.indptr, old.indptr[-1] + indptr))
+            indices = np.concatenate((old.indices, indices))
+            norms = np.concatenate((self._norms, np.sqrt(lengths)))
+        else:
+            indptr = np.concatenate(([0], indptr))
+            norms = np.sqrt(lengths)
+        data = np.ones(len(indices), dtype=np.float64)
+        self._csr = csr_matrix((data, indices, indptr), shape=shape)
+        self._csc = None
+        self._norms = norms
+        self._built, self._stale = shape[0], False
+
+    def vector(self, weights: Dict[str, float]) -> np.ndarray:
+        """Dense user vector over the known tag columns (unknown tags are ignored)."""
+        vec = np.zeros(len(self.columns), dtype=np.float64)
+        for tag, w in weights.items():
+            col = self.columns.get(tag)
+            if col is not None:
+                vec[col] = w
+        return vec
+
+    def dots(self, user_vec: np.ndarray) -> np.ndarray:
+        """Raw dot product of every row with `user_vec`."""
+        self._build()
+        if len(user_vec) < self._csr.shape[1]:
+            user_vec = np.pad(user_vec, (0, self._csr.shape[1] - len(user_vec)))
+        return self._csr @ user_vec
+
+    def norms(self) -> np.ndarray:
+        self._build()
+        return self._norms
+
+    def rows_with(self, tag: str) -> np.ndarray:
+        """Rows whose character carries `tag`."""
+        col = self.columns.get(tag)
+        if col is None:
+            return np.empty(0, dtype=np.int32)
+        self._build()
+        if self._csc is None:
+            self._csc = self._csr.tocsc()
+        start, end = self._csc.indptr[col], self._csc.indptr[col + 1]
+        return self._csc.indices[start:end]
+
+    def item(self, row: int):
+        return self._items[row]
+
+    def scores(self, user_vec: np.ndarray) -> np.ndarray:
+        """Cosine similarity of every row to `user_vec`; rows without tags get -inf."""
+        dots = self.dots(user_vec)
+        unorm = float(np.linalg.norm(user_vec)) or 1.0
+        with np.errstate(divide="ignore", invalid="ignore"):
+            scores = dots / (self._norms * unorm)
+        scores[self._norms == 0] = -np.inf
+        return np.round(scores, 12)   # equal cosines compare equal, so ties keep row order
+
+    def top(self, scores: np.ndarray, n: int) -> List[object]:
+        """Items of the `n` best rows, best first (ties keep row order)."""
+        return [self._items[r] for r in self.top_rows(scores, n)]
+
+    @staticmethod
+    def top_rows(scores: np.ndarray, n: int) -> np.ndarray:
+        valid = np.flatnonzero(np.isfinite(scores))
+        if n <= 0 or len(valid) == 0:
+            return valid[:0]
+        if len(valid) > n:
+            vs = scores[valid]
+            kth = vs[np.argpartition(-vs, n - 1)[n - 1]]    # n-th best score
+            better = valid[vs > kth]
+            valid = np.concatenate((better, valid[vs == kth][:n - len(better)]))
+        return valid[np.lexsort((valid, -scores[valid]))]
+
+
+class UserRecommendations:
+    """
+    One user's count-weighted tag profile against a TagMatrix, with cached
+    per-character dot products and a maintained top-N. Cosine order only
+    depends on dot / row norm (the user's own norm is common to all rows),
+    and counts only grow, so after a delta the new top-N is among the old
+    top-N plus the rows that carry the changed tags.
+    """
+
+    def __init__(self, matrix: TagMatrix, interactions: Dict[str, int], top_n: int = 10):
+        self.matrix = matrix
+        self.top_n = top_n
+        self.weights: Dict[str, float] = {t: float(c) for t, c in interactions.items() if t}
+        self._dots: Optional[np.ndarray] = None
+        self._top: List[Tuple[float, int]] = []   # (-rank key, row), best first
+        self._version = -1
+
+    def _rebuild(self):
+        m = self.matrix
+        self._dots = m.dots(m.vector(self.weights))
+        norms = m.norms()
+        with np.errstate(divide="ignore", invalid="ignore"):
+            keys = np.round(self._dots / norms, 12)
+        keys[norms == 0] = -np.inf
+        self._top = [(-float(keys[r]), int(r)) for r in m.top_rows(keys, self.top_n)]
+        self._version = m.version
+
+    def apply(self, delta: Dict[str, int]):
+        """Add tag counts; re-score only the rows carrying those tags."""
+        for tag, inc in delta.items():
+            self.weights[tag] = self.weights.get(tag, 0.0) + inc
+        if self._version != self.matrix.version:   # catalog changed – rebuilt on next read
+            return
+        touched = []
+        for tag, inc in delta.items():
+            rows = self.matrix.rows_with(tag)
+            self._dots[rows] += inc
+            touched.append(rows)
+        cand = np.unique(np.concatenate(touched + [np.array([r for _, r in self._top], dtype=np.int32)]))
+        norms = self.matrix.norms()[cand]
+        with np.errstate(divide="ignore", invalid="ignore"):
+            keys = np.round(self._dots[cand] / norms, 12)
+        keys[norms == 0] = -np.inf
+        best = TagMatrix.top_rows(keys, self.top_n)        # positions within `cand`
+        self._top = [(-float(keys[i]), int(cand[i])) for i in best]
+
+    def top(self) -> List[object]:
+        if self._version != self.matrix.version:
+            self._rebuild()
+        return [self.matrix.item(row) for _, row in self._top]
 
-# Compute cosine similarity between two tag vectors
-def similarity_score(vec1, vec2):
-    if not vec1 or not vec2:
-        return 0.0
-    return cosine_similarity([vec1], [vec2])[0][0]
 
 # Match user tags against all characters
 def recommend_by_tags(user_tags, all_characters, top_n=10):
-    tag_universe = list(set(
-        tag
-        for char in all_characters
-        if isinstance(char.get("tags"), list)
-        for tag in char["tags"]
-    ))
-
-    if not tag_universe:
+    matrix = TagMatrix()
+    for i, char in enumerate(all_characters):
+        tags = char.get("tags")
+        matrix.set_row(i, char, tags if isinstance(tags, list) else [])
+
+    if not matrix.columns:
         print("⚠ Warning: No tags found in any character.")
         return []
 
-    user_vector = tag_vector(user_tags, tag_universe)
-    scored = []
+    user_vec = matrix.vector({tag: 1.0 for tag in user_tags})
+    return matrix.top(matrix.scores(user_vec), top_n)
+
+
+# the catalog's characters, kept in step with it between homepage builds
+_catalog_matrix = TagMatrix()
+
+def _sync_catalog() -> TagMatrix:
+    records = list_characters()   # metadata only, no persona text
+    seen = set()
+    for rec in records:
+        key = (rec.ip, rec.path)
+        seen.add(key)
+        if _catalog_matrix.stamp(key) != (rec.mtime, rec.size):
+            tags = rec.tags if isinstance(rec.tags, list) else []
+            _catalog_matrix.set_row(key, rec, tags, stamp=(rec.mtime, rec.size))
+    for key in set(_catalog_matrix.keys()) - seen:
+        _catalog_matrix.remove(key)
+    return _catalog_matrix
 
-    for char in all_characters:
-        tags = char.get("tags", [])
-        if not tags:
-            continue
-        char_vector = tag_vector(tags, tag_universe)
-        score = similarity_score(user_vector, char_vector)
-        scored.append((score, char))
+# username → incremental recommendation state
+_users: Dict[str, UserRecommendations] = {}
 
-    scored.sort(reverse=True, key=lambda x: x[0])
-    return [char for score, char in scored[:top_n]]
+def _apply_user_delta(username: str, delta: Dict[str, int]):
+    state = _users.get(username)
+    if state is not None:
+        state.apply(delta)
+
+on_user_tags(_apply_user_delta)
 
 # Public API from GUI: requires user_data
 def recommend_characters(user_data):
-    characters = load_all_characters()
-    if not characters:
+    matrix = _sync_catalog()
+    if not len(matrix):
         print("⚠ No characters loaded.")
         return []
+    if not matrix.columns:
+        print("⚠ Warning: No tags found in any character.")
+        return []
 
-    preferred_tags = extract_user_tags(user_data)
-    return recommend_by_tags(preferred_tags, characters, top_n=10)
\ No newline at end of file
+    state = _users.get(user_data["username"])
+    if state is None:
+        state = _users[user_data["username"]] = UserRecommendations(
+            matrix, user_data["interactions"], top_n=10)
+    return state.top()
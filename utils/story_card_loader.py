@@ -52,6 +52,20 @@ def load_predefined_cards(ip_name: str):
                 cards.append(card)
     return cards
 
+
+def story_card_snippets(cards) -> list[str]:
+    """One "*name*: entry" line per card, as the chat prompts expect them."""
+    snippets: list[str] = []
+    for c in cards:
+        entry = (
+            c.get("entry")
+            or c.get("description")
+            or json.dumps(c, ensure_ascii=False)
+        )
+        tag = c.get("name") or c.get("type", "Info")
+        snippets.append(f"*{tag}*: {entry}")
+    return snippets
+
 # ══════════════════════ user‑selected external cards ══════════════════════
 
 def choose_external_cards(parent_win=None):
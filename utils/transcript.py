@@ -0,0 +1,158 @@
+from typing import Dict, List, Optional
+
+# ---------------------------------------------------------------------------
+#   Chat transcript model (no Tk in here)
+# ---------------------------------------------------------------------------
+# Ordered turns with stable ids. Reply turns keep every generated version
+# plus the active index, exactly like the ◀ ▶ buttons show them. Each turn's
+# rendered prompt piece is cached and only re-rendered after it changed, so
+#   append        O(1)
+#   edit / flip   O(1)  (that one piece)
+#   delete tail   O(k)  (k = turns removed)
+# and building a prompt never re-walks widgets or re-joins the whole chat.
+# ---------------------------------------------------------------------------
+
+
+class Turn:
+    __slots__ = ("id", "role", "text", "versions", "idx")
+
+    def __init__(self, tid: int, role: str, text: str = ""):
+        self.id = tid
+        self.role = role            # "intro" | "user" | "reply"
+        self.text = text            # intro / user message
+        self.versions: List[Dict[str, str]] = []   # reply: [{"narr", "reply"[, "image"]}]
+        self.idx = -1
+
+    @property
+    def current(self) -> Optional[Dict[str, str]]:
+        return self.versions[self.idx] if self.versions else None
+
+
+class Transcript:
+    """
+    The dialogue of one chatroom. The GUI is a view over it; `pieces()` is
+    what the prompt context is built from.
+    """
+
+    def __init__(self, char_name: str, intro: str = ""):
+        self.char_name = char_name
+        self._turns: List[Turn] = []
+        self._rendered: List[str] = []
+        self._pos: Dict[int, int] = {}
+        self._stale: set = set()
+        self._next_id = 0
+        if intro:
+            self._append(Turn(self._new_id(), "intro", intro))
+
+    def __len__(self) -> int:
+        return len(self._turns)
+
+    def _new_id(self) -> int:
+        self._next_id += 1
+        return self._next_id - 1
+
+    def _render(self, turn: Turn) -> str:
+        if turn.role == "intro":
+            return turn.text
+        if turn.role == "user":
+            return f"User: {turn.text}"
+        cur = turn.current
+        return f"{self.char_name}: {cur['reply'] if cur else ''}"
+
+    def _append(self, turn: Turn) -> Turn:
+        self._pos[turn.id] = len(self._turns)
+        self._turns.append(turn)
+        self._rendered.append(self._render(turn))
+        return turn
+
+    def _changed(self, tid: int):
+        self._stale.add(tid)
+
+    # ── reads ──────────────────────────────────────────────────────────────
+    def get(self, tid: int) -> Turn:
+        return self._turns[self._pos[tid]]
+
+    def turns(self) -> List[Turn]:
+        """All turns, oldest first (a copy of the list)."""
+        return list(self._turns)
+
+    def last(self, role: str, before: Optional[int] = None) -> Optional[Turn]:
+        """Most recent turn with this role (preceding turn `before` if given), or None."""
+        end = self._pos[before] if before is not None else len(self._turns)
+        for turn in reversed(self._turns[:end]):
+            if turn.role == role:
+                return turn
+        return None
+
+    def pieces(self, before: Optional[int] = None) -> List[str]:
+        """
+        Rendered prompt pieces, oldest first; with `before`, only those of
+        the turns preceding turn `before`. Only turns changed since the last
+        call are re-rendered; the returned list is a shallow copy, safe to
+        hand to a worker thread.
+        """
+        for tid in self._stale:
+            pos = self._pos.get(tid)
+            if pos is not None:
+                self._rendered[pos] = self._render(self._turns[pos])
+        self._stale.clear()
+        if before is not None:
+            return self._rendered[:self._pos[before]]
+        return list(self._rendered)
+
+    def render(self) -> str:
+        return "\n\n".join(self.pieces())
+
+    # ── writes ─────────────────────────────────────────────────────────────
+    def add_user(self, text: str) -> Turn:
+        return self._append(Turn(self._new_id(), "user", text))
+
+    def add_reply(self) -> Turn:
+        return self._append(Turn(self._new_id(), "reply"))
+
+    def new_version(self, tid: int) -> Dict[str, str]:
+        turn = self.get(tid)
+        turn.versions.append({"narr": "*", "reply": ""})
+        turn.idx = len(turn.versions) - 1
+        self._changed(tid)
+        return turn.current
+
+    def append_text(self, tid: int, field: str, tok: str):
+        """Stream a token into the active version ("narr" or "reply")."""
+        self.get(tid).current[field] += tok
+        if field == "reply":
+            self._changed(tid)
+
+    def attach_image(self, tid: int, idx: int, path: str) -> bool:
+        """Remember the scene image of one reply version (False if it is gone)."""
+        pos = self._pos.get(tid)
+        if pos is None or not 0 <= idx < len(self._turns[pos].versions):
+            return False
+        self._turns[pos].versions[idx]["image"] = path
+        return True
+
+    def set_version(self, tid: int, idx: int):
+        turn = self.get(tid)
+        if 0 <= idx < len(turn.versions):
+            turn.idx = idx
+            self._changed(tid)
+
+    def edit(self, tid: int, text: str):
+        """Replace a user message, or the active version of a reply."""
+        turn = self.get(tid)
+        if turn.role == "reply":
+            turn.current["reply"] = text
+        else:
+            turn.text = text
+        self._changed(tid)
+
+    def truncate(self, tid: int) -> List[int]:
+        """Delete turn `tid` and every later turn; returns the removed ids."""
+        pos = self._pos[tid]
+        removed = [t.id for t in self._turns[pos:]]
+        del self._turns[pos:]
+        del self._rendered[pos:]
+        for rid in removed:
+            del self._pos[rid]
+            self._stale.discard(rid)
+        return removed
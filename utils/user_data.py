@@ -1,36 +1,159 @@
+import atexit
 import os
 import json
+import threading
 
 USER_DATA_DIR = os.path.join(os.path.dirname(__file__), "..", "users")
 os.makedirs(USER_DATA_DIR, exist_ok=True)
 
+# ---------------------------------------------------------------------------
+#   Profile persistence
+# ---------------------------------------------------------------------------
+# update_user_tags only marks the profile dirty; a background timer writes it
+# USER_SAVE_DELAY seconds later (coalescing every turn in between), and
+# whatever is still dirty is flushed at exit. Writes go to a temp file that
+# is renamed over the profile, so a crash never leaves half a JSON behind.
+# With USER_DELTA_LOG=1 each update is also appended to users/<name>.log
+# (one short line) and replayed on load, so even the last few seconds
+# survive a crash; the log is cut back whenever the profile is written.
+#
+# USER_BACKEND=sqlite keeps profiles in users/users.db instead (see
+# utils/user_store.py): same functions, but every tag update is written at
+# once as an UPSERT increment, safe with many concurrent sessions.
+# ---------------------------------------------------------------------------
+
+SAVE_DELAY = float(os.getenv("USER_SAVE_DELAY", "2.0"))
+DELTA_LOG = os.getenv("USER_DELTA_LOG", "0") == "1"
+USER_BACKEND = os.getenv("USER_BACKEND", "json")
+USER_DB_PATH = os.path.join(USER_DATA_DIR, "users.db")
+
+_lock = threading.RLock()
+_dirty = {}      # username → user_data waiting to be written
+_timer = None
+_store = None    # UserStore when USER_BACKEND=sqlite
+
+def _sqlite():
+    """The SQLite store, or None with the JSON backend (opened on first use)."""
+    global _store
+    if USER_BACKEND != "sqlite":
+        return None
+    with _lock:
+        if _store is None:
+            from utils.user_store import UserStore
+            _store = UserStore(USER_DB_PATH, json_dir=USER_DATA_DIR)   # imports old JSON once
+        return _store
+
+def _profile_path(username):
+    return os.path.join(USER_DATA_DIR, f"{username}.json")
+
+def _log_path(username):
+    return os.path.join(USER_DATA_DIR, f"{username}.log")
+
+def _write_atomic(path, data):
+    tmp = f"{path}.tmp"
+    with open(tmp, "w", encoding="utf-8") as f:
+        json.dump(data, f, indent=4)
+    os.replace(tmp, path)
+
+def _replay_log(user_data):
+    """Apply logged deltas newer than the profile snapshot."""
+    try:
+        with open(_log_path(user_data["username"]), "r", encoding="utf-8") as f:
+            lines = f.readlines()
+    except OSError:
+        return
+    seq = user_data.get("log_seq", 0)
+    for line in lines:
+        try:
+            entry = json.loads(line)
+        except ValueError:      # torn last line from a crash
+            continue
+        if entry["seq"] <= seq:
+            continue
+        for tag, inc in entry["tags"].items():
+            user_data["interactions"][tag] = user_data["interactions"].get(tag, 0) + inc
+        seq = entry["seq"]
+    if seq:
+        user_data["log_seq"] = seq
+
 # Load or create a user profile
 def load_user(username):
-    file_path = os.path.join(USER_DATA_DIR, f"{username}.json")
+    store = _sqlite()
+    if store is not None:
+        return store.load(username)
+    file_path = _profile_path(username)
     if os.path.exists(file_path):
         with open(file_path, "r", encoding="utf-8") as f:
-            return json.load(f)
+            user_data = json.load(f)
+        _replay_log(user_data)
+        return user_data
     else:
         user_data = {
             "username": username,
             "interactions": {}
         }
-        with open(file_path, "w", encoding="utf-8") as f:
-            json.dump(user_data, f, indent=4)
+        _write_atomic(file_path, user_data)
         return user_data
 
-# Save updated profile
+# Save updated profile (now, atomically)
 def save_user(user_data):
-    file_path = os.path.join(USER_DATA_DIR, f"{user_data['username']}.json")
-    with open(file_path, "w", encoding="utf-8") as f:
-        json.dump(user_data, f, indent=4)
+    store = _sqlite()
+    if store is not None:
+        store.save(user_data)
+        return
+    username = user_data["username"]
+    with _lock:
+        _dirty.pop(username, None)
+        _write_atomic(_profile_path(username), user_data)
+        if DELTA_LOG and os.path.exists(_log_path(username)):
+            open(_log_path(username), "w").close()   # everything up to log_seq is in the profile
+
+def flush_users():
+    """Write every dirty profile now (also runs at exit)."""
+    global _timer
+    with _lock:
+        pending = list(_dirty.values())
+        _timer = None
+    for user_data in pending:
+        save_user(user_data)
+
+atexit.register(flush_users)
+
+def schedule_save(user_data):
+    """Mark the profile dirty; it is written within SAVE_DELAY seconds."""
+    global _timer
+    with _lock:
+        _dirty[user_data["username"]] = user_data
+        if _timer is None:
+            _timer = threading.Timer(SAVE_DELAY, flush_users)
+            _timer.daemon = True
+            _timer.start()
+
+# callbacks(username, {tag: +count}) run after every update_user_tags
+_tag_listeners = []
+
+def on_user_tags(callback):
+    _tag_listeners.append(callback)
 
 # Update interaction tags
 def update_user_tags(user_data, character):
-    for tag in character.get("tags", []):
-        if tag:
-            user_data["interactions"][tag] = user_data["interactions"].get(tag, 0) + 1
-    save_user(user_data)
+    delta = {}
+    with _lock:
+        for tag in character.get("tags", []):
+            if tag:
+                user_data["interactions"][tag] = user_data["interactions"].get(tag, 0) + 1
+                delta[tag] = delta.get(tag, 0) + 1
+        if DELTA_LOG and delta and USER_BACKEND != "sqlite":
+            user_data["log_seq"] = user_data.get("log_seq", 0) + 1
+            with open(_log_path(user_data["username"]), "a", encoding="utf-8") as f:
+                f.write(json.dumps({"seq": user_data["log_seq"], "tags": delta}) + "\n")
+    for callback in _tag_listeners:
+        callback(user_data["username"], delta)
+    store = _sqlite()
+    if store is not None:
+        store.increment(user_data["username"], delta)   # one UPSERT batch, no rewrite
+    else:
+        schedule_save(user_data)
 
 # Convert interactions into sorted tag list
 def extract_user_tags(user_data, top_k=10):
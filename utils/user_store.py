@@ -0,0 +1,121 @@
+import glob
+import json
+import os
+import sqlite3
+import threading
+import time
+from typing import Dict
+
+# ---------------------------------------------------------------------------
+#   SQLite profile + interaction store (USER_BACKEND=sqlite)
+# ---------------------------------------------------------------------------
+# One row per user and one per (user, tag) with its count, in WAL mode so
+# many sessions read while one writes. A chat's tag delta is a single UPSERT
+# batch (count = count + n) inside one transaction, so concurrent sessions –
+# threads or processes – never lose each other's increments. Existing
+# users/<name>.json profiles are imported once, the first time the store opens.
+# ---------------------------------------------------------------------------
+
+_SCHEMA = """
+CREATE TABLE IF NOT EXISTS users (
+    username TEXT PRIMARY KEY,
+    created  REAL NOT NULL
+);
+CREATE TABLE IF NOT EXISTS interactions (
+    username TEXT NOT NULL,
+    tag      TEXT NOT NULL,
+    count    INTEGER NOT NULL DEFAULT 0,
+    PRIMARY KEY (username, tag)
+);
+CREATE INDEX IF NOT EXISTS interactions_tag ON interactions (tag);
+CREATE TABLE IF NOT EXISTS meta (
+    key   TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+class UserStore:
+    """
+    Thread-safe SQLite backend for user_data (one shared connection,
+    serialised by a lock; other processes are handled by SQLite's busy wait).
+    """
+
+    def __init__(self, path: str, json_dir: str = ""):
+        self.path = path
+        self._lock = threading.Lock()
+        self._db = sqlite3.connect(path, check_same_thread=False, timeout=10.0)
+        self._db.execute("PRAGMA journal_mode=WAL")
+        self._db.execute("PRAGMA synchronous=NORMAL")
+        self._db.executescript(_SCHEMA)
+        if json_dir:
+            self.migrate_json(json_dir)
+
+    def close(self):
+        with self._lock:
+            self._db.close()
+
+    def load(self, username: str) -> Dict:
+        """Profile dict in the JSON layout; the user row is created on first use."""
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO users (username, created) VALUES (?, ?)",
+                (username, time.time()))
+            rows = self._db.execute(
+                "SELECT tag, count FROM interactions WHERE username = ?", (username,)).fetchall()
+        return {"username": username, "interactions": dict(rows)}
+
+    def save(self, user_data: Dict):
+        """Replace the stored counts with the ones in `user_data`."""
+        username = user_data["username"]
+        rows = [(username, tag, count) for tag, count in user_data["interactions"].items()]
+        with self._lock, self._db:
+            self._db.execute(
+                "INSERT OR IGNORE INTO users (username, created) VALUES (?, ?)",
+                (username, time.time()))
+            self._db.execute("DELETE FROM interactions WHERE username = ?", (username,))
+            self._db.executemany(
+                "INSERT INTO interactions (username, tag, count) VALUES (?, ?, ?)", rows)
+
+    def increment(self, username: str, delta: Dict[str, int]):
+        """Add `delta` to the user's tag counts in one transaction."""
+        if not delta:
+            return
+        with self._lock, self._db:
+            self._db.executemany(
+                """INSERT INTO interactions (username, tag, count) VALUES (?, ?, ?)
+                   ON CONFLICT (username, tag) DO UPDATE SET count = count + excluded.count""",
+                [(username, tag, n) for tag, n in delta.items()])
+
+    def migrate_json(self, json_dir: str) -> int:
+        """Import users/<name>.json once; returns how many profiles were imported."""
+        with self._lock:
+            done = self._db.execute("SELECT 1 FROM meta WHERE key = 'json_migrated'").fetchone()
+        if done:
+            return 0
+        imported = 0
+        for path in sorted(glob.glob(os.path.join(json_dir, "*.json"))):
+            try:
+                with open(path, "r", encoding="utf-8") as f:
+                    data = json.load(f)
+                username, counts = data["username"], data.get("interactions", {})
+            except (OSError, ValueError, KeyError, TypeError) as exc:
+                print(f"⚠️ Skipping profile {path}: {exc}")
+                continue
+            with self._lock, self._db:
+                known = self._db.execute(
+                    "SELECT 1 FROM users WHERE username = ?", (username,)).fetchone()
+                if known:
+                    continue
+                self._db.execute(
+                    "INSERT INTO users (username, created) VALUES (?, ?)",
+                    (username, os.path.getmtime(path)))
+                self._db.executemany(
+                    "INSERT INTO interactions (username, tag, count) VALUES (?, ?, ?)",
+                    [(username, tag, int(n)) for tag, n in counts.items() if tag])
+            imported += 1
+        with self._lock, self._db:
+            self._db.execute("INSERT OR REPLACE INTO meta VALUES ('json_migrated', ?)", (str(time.time()),))
+        if imported:
+            print(f"✅ Imported {imported} JSON profile(s) into {self.path}")
+        return imported